@@ -6,18 +6,58 @@ TODO: - add something amazing
       - bask in awe at the output from the prior step
       - legit though maybe a choropleth based on our constructed polygons or something? could be norty just sayin'
 """
+import os
+import sys
+import urllib.request
 import pandas as pd
-from typing import List
+from typing import List, Optional, Callable, Dict, Any, Tuple
+import flask
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State, ClientsideFunction
 import plotly.express as px
-DF = pd.read_csv('data/monmouthshire_properties.csv')
+import plotly.graph_objects as go
+from property_store import filter_properties, get_compact_payload
+from price_tiles import get_viewport_surface
+from background_jobs import handle_job_callback
 
 
-app = dash.Dash(__name__)
+CATEGORICAL_VARIABLES = ['property_type', 'estate_type', 'building_type', 'town', 'district', 'transaction_category',
+                         'parish', 'postcode_area', 'postcode_district', 'postcode_sector', 'closest_store', 'ward']
+CLIENTSIDE_COLUMNS = ['town', 'year', 'true_price', 'longitude', 'latitude', 'grid_cell', 'interpolated_price'] + [
+    variable for variable in CATEGORICAL_VARIABLES if variable != 'town']
+DATA_ENDPOINT = '/data/properties.arrow'
+ARROW_JS_URL = 'https://cdn.jsdelivr.net/npm/apache-arrow@4.0.1/Arrow.es5.min.js'
+ARROW_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'Arrow.es5.min.js')  # vendored copy
+
+
+def vendor_arrow_js(
+    url: str = ARROW_JS_URL,
+    path: str = ARROW_JS,
+) -> None:
+    """Download the javascript arrow library into assets/, which dash then serves itself along with the clientside
+    callbacks, so the location scatter and violins don't need the CDN (or the internet at all). Only needs doing once,
+    or when bumping the version, and the file gets committed.
+
+    Parameters
+    ----------
+    url : Where to download the library from.
+    path : Where to save it.
+    """
+    with urllib.request.urlopen(url) as response:
+        script = response.read()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(script)
+    os.replace(path + '.tmp', path)
+
+
+# dash serves everything in assets/ by itself, so the CDN is only a fallback for when the vendored copy is missing
+app = dash.Dash(__name__, external_scripts=[] if os.path.exists(ARROW_JS) else [ARROW_JS_URL])
 app.layout = html.Div([
+    dcc.Store(id='properties_data_loaded', data=False),
+    dcc.Interval(id='properties_data_poll', interval=200),
+
     html.Div([
         html.H2('1.1 Locations of Sold Properties', style={'display': 'flex',
                                                            'justifyContent': 'center',
@@ -76,8 +116,11 @@ app.layout = html.Div([
             ], style={'width': '20%', 'display': 'inline-block', 'justifyContent': 'center', 'align-items': 'center'}),
 
         html.Div([
+            html.Div(id='cost_scatter_status'),
             dcc.Graph(id='cost_scatter',
-                      figure={})
+                      figure={}),
+            dcc.Store(id='cost_scatter_job'),
+            dcc.Interval(id='cost_scatter_poll', interval=500, disabled=True)
         ])
     ]),
 
@@ -87,18 +130,7 @@ app.layout = html.Div([
                                                              'align-items': 'center'}),
 
         dcc.Dropdown(id='variables_dropdown_2',
-                     options=[{'label': 'property_type', 'value': 'property_type'},
-                              {'label': 'estate_type', 'value': 'estate_type'},
-                              {'label': 'building_type', 'value': 'building_type'},
-                              {'label': 'town', 'value': 'town'},
-                              {'label': 'district', 'value': 'district'},
-                              {'label': 'transaction_category', 'value': 'transaction_category'},
-                              {'label': 'parish', 'value': 'parish'},
-                              {'label': 'postcode_area', 'value': 'postcode_area'},
-                              {'label': 'postcode_district', 'value': 'postcode_district'},
-                              {'label': 'postcode_sector', 'value': 'postcode_sector'},
-                              {'label': 'closest_store', 'value': 'closest_store'},
-                              {'label': 'ward', 'value': 'ward'}],
+                     options=[{'label': variable, 'value': variable} for variable in CATEGORICAL_VARIABLES],
                      value='building_type',
                      multi=False),
 
@@ -107,12 +139,30 @@ app.layout = html.Div([
                       figure={})
         ])
     ]),
+
+    html.Div([
+        html.H2('1.4 Price Surface', style={'display': 'flex',
+                                            'justifyContent': 'center',
+                                            'align-items': 'center'}),
+
+        dcc.Slider(id='price_surface_year',
+                   min=1995,
+                   max=2021,
+                   step=1,
+                   value=2020,
+                   marks={year: {'label': str(year)} for year in range(1995, 2021, 5)}),
+
+        dcc.Graph(id='price_surface',
+                  figure={})
+    ]),
 ])
 
 
 def get_requested_df(
     properties_to_plot: List[str],
     date_range: List[int],
+    columns: Optional[List[str]] = None,
+    true_price_only: bool = False,
 ) -> pd.DataFrame:
     """Get the requested data from the various pushy buttons bits.
 
@@ -120,129 +170,212 @@ def get_requested_df(
     ----------
     properties_to_plot : List of desired values from the 'town' column of the property dataset.
     date_range : List of start and end date of desired date range.
+    columns : Columns needed for the plot, or None for all of them.
+    true_price_only : Set True to only get rows where the property actually sold that year.
 
     Returns
     -------
     pd.DataFrame
         Requested data pls.
     """
-    requested_df = DF[DF['town'].isin(properties_to_plot)]
-    requested_df = requested_df[(requested_df['year'] >= date_range[0]) & (requested_df['year'] <= date_range[1])]
-
-    return requested_df
+    return filter_properties(towns=properties_to_plot,
+                             year_range=date_range,
+                             columns=columns,
+                             true_price_only=true_price_only)
 
 
-@app.callback(
-    Output(component_id='properties_scatter', component_property='figure'),
-    [Input(component_id='properties_to_plot', component_property='value'),
-     Input(component_id='date_range_for_price_data', component_property='value')]
-)
-def update_scatter_plot(
-    properties_to_plot: List[str],
+def build_cost_scatter(
     date_range: List[int],
-) -> px.scatter:
-    """Choose which data to plot on the scatter axis.
+    properties_to_plot: List[str],
+    variable_to_plot: str,
+    progress: Callable[[float, str], None],
+) -> Dict[str, Any]:
+    """Build the scatter plot of cost of property over time vs some other variable chosen by a dropdown menu. Runs as
+    a background job as the lowess trendline takes a good while on the bigger selections.
+
+    Notes
+    -----
+    Currently this includes interpolated prices, might be worth ditching these or making it possible to turn them on
+    or off prehaps?
 
     Parameters
     ----------
-    properties_to_plot : List of desired values from the 'town' column of the property dataset.
     date_range : List of start and end date of desired date range.
+    properties_to_plot : List of towns to include in the graph.
+    variable_to_plot : Variable that will become the x axis for the resultant scatter plot.
+    progress : Reporter to tell the dashboard how we're getting on.
 
     Returns
     -------
-    px.scatter
-        Plotly graph containing the desired points in space
+    Dict[str, Any]
+        Plotly express scatter plot displaying the analysis for the chosen period / variables, as a dict.
     """
-    df_to_plot = get_requested_df(properties_to_plot, date_range)
-    df_to_plot = df_to_plot[df_to_plot['true_price'] == 1]
+    progress(0.1, 'Fetching data')
+    df_to_plot = get_requested_df(properties_to_plot, date_range, columns=[variable_to_plot, 'interpolated_price'])
 
-    fig = px.scatter(
-        data_frame=df_to_plot,
-        x='longitude',
-        y='latitude',
-        color='town',
-    )
+    progress(0.3, 'Fitting trendline')
+    fig = px.scatter(data_frame=df_to_plot,
+                     x=variable_to_plot,
+                     y='interpolated_price',
+                     trendline='lowess')
 
-    return fig
+    return fig.to_dict()
 
 
 @app.callback(
-    Output(component_id='cost_scatter', component_property='figure'),
-    [Input(component_id='date_range_for_price_data', component_property='value'),
+    [Output(component_id='cost_scatter', component_property='figure'),
+     Output(component_id='cost_scatter_status', component_property='children'),
+     Output(component_id='cost_scatter_job', component_property='data'),
+     Output(component_id='cost_scatter_poll', component_property='disabled')],
+    [Input(component_id='cost_scatter_poll', component_property='n_intervals'),
+     Input(component_id='date_range_for_price_data', component_property='value'),
      Input(component_id='properties_to_plot', component_property='value'),
-     Input(component_id='variables_dropdown', component_property='value')]
+     Input(component_id='variables_dropdown', component_property='value')],
+    State(component_id='cost_scatter_job', component_property='data')
 )
 def update_cost_scatter(
+    n_intervals: int,
     date_range: List[int],
     properties_to_plot: List[str],
     variable_to_plot: str,
-) -> px.scatter:
-    """Update contents of scatter plot which plots some scattered points for cost of property over time vs some other
-    variable chosen by a dropdown menu.
-
-    Notes
-    -----
-    Currently this includes interpolated prices, might be worth ditching these or making it possible to turn them on
-    or off prehaps?
+    job_id: Optional[str],
+) -> Tuple[Any, str, Optional[str], bool]:
+    """Kick off building the cost scatter plot in the background whenever the controls change, replacing any build
+    still going for the old values, then check in on it each time the poll fires until its ready.
 
     Parameters
     ----------
+    n_intervals : Number of times the poll has fired, only here to trigger the callback.
     date_range : List of start and end date of desired date range.
     properties_to_plot : List of towns to include in the graph.
     variable_to_plot : Variable that will become the x axis for the resultant scatter plot.
+    job_id : ID of the current background job, if any.
 
     Returns
     -------
-    px.scatter
-        Plotly express scatter plot object displaying the analysis for the chosen period / variables
+    Tuple[Any, str, Optional[str], bool]
+        The figure once it's ready, progress message, job ID and whether to stop polling.
     """
-    df_to_plot = get_requested_df(properties_to_plot, date_range)
+    poll_triggered = dash.callback_context.triggered[0]['prop_id'].startswith('cost_scatter_poll')
 
-    fig = px.scatter(data_frame=df_to_plot,
-                     x=variable_to_plot,
-                     y='interpolated_price',
-                     trendline='lowess')
+    return handle_job_callback(poll_triggered, job_id, build_cost_scatter,
+                               date_range, properties_to_plot, variable_to_plot)
 
-    return fig
+
+def get_viewport(relayout_data: Optional[Dict[str, Any]]) -> Tuple[Optional[List[float]], Optional[List[float]]]:
+    """Dig the visible long / lat ranges out of a graphs relayoutData, which comes in a few different shapes depending
+    on whether the user zoomed, panned or double clicked back out.
+
+    Parameters
+    ----------
+    relayout_data : relayoutData of the graph.
+
+    Returns
+    -------
+    Tuple[Optional[List[float]], Optional[List[float]]]
+        Longitude and latitude ranges, None for either axis that's showing everything.
+    """
+    relayout_data = relayout_data or {}
+
+    def axis_range(axis: str) -> Optional[List[float]]:
+        if f'{axis}.range' in relayout_data:
+            return list(relayout_data[f'{axis}.range'])
+        if f'{axis}.range[0]' in relayout_data:
+            return [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+        return None
+
+    return axis_range('xaxis'), axis_range('yaxis')
 
 
 @app.callback(
-    Output(component_id='cost_violins', component_property='figure'),
-    [Input(component_id='date_range_for_price_data', component_property='value'),
-     Input(component_id='properties_to_plot', component_property='value'),
-     Input(component_id='variables_dropdown_2', component_property='value')]
+    Output(component_id='price_surface', component_property='figure'),
+    [Input(component_id='price_surface_year', component_property='value'),
+     Input(component_id='price_surface', component_property='relayoutData')]
 )
-def update_violin_plots(
-    date_range: List[int],
-    properties_to_plot: List[str],
-    variable_to_plot: str,
-) -> px.violin:
-    """Update contents of violin plots for categorical data
-
-    Notes
-    -----
-    Currently this includes interpolated prices, might be worth ditching these or making it possible to turn them on
-    or off prehaps?
+def update_price_surface(
+    year: int,
+    relayout_data: Optional[Dict[str, Any]],
+) -> go.Figure:
+    """Draw the pre-built price surface for a year, fetching only the tiles that cover the current viewport at a level
+    of detail to match the zoom. Zooming in swaps in finer tiles, zooming out swaps in coarser ones.
 
     Parameters
     ----------
-    date_range : List of start and end date of desired date range.
-    properties_to_plot : List of towns to include in the graph.
-    variable_to_plot : Variable that will become the x axis for the resultant violin plot.
+    year : Year to show.
+    relayout_data : relayoutData of the map, for the current viewport.
 
     Returns
     -------
-    px.violin
-        Plotly express violin plot object displaying the analysis for the chosen period / variables
+    go.Figure
+        Heatmap of the mean price per pixel.
     """
-    df_to_plot = get_requested_df(properties_to_plot, date_range)
-
-    fig = px.violin(data_frame=df_to_plot,
-                    x=variable_to_plot,
-                    y='interpolated_price')
+    lon_range, lat_range = get_viewport(relayout_data)
+    surface = get_viewport_surface(year, lon_range, lat_range)
+
+    fig = go.Figure()
+    if surface is not None:
+        fig.add_trace(go.Heatmap(z=surface['z'],
+                                 x0=surface['x0'],
+                                 dx=surface['dx'],
+                                 y0=surface['y0'],
+                                 dy=surface['dy'],
+                                 colorscale='Viridis',
+                                 colorbar={'title': 'Mean price'},
+                                 hoverongaps=False))
+    fig.update_layout(title=f'{year} Mean Price' + (f' (detail level {surface["level"]})' if surface else ' (no data)'),
+                      xaxis={'title': 'longitude', 'range': lon_range},
+                      yaxis={'title': 'latitude', 'range': lat_range},
+                      uirevision='price_surface')  # keeps the users zoom when the figure gets swapped out
 
     return fig
 
 
+@app.server.route(DATA_ENDPOINT)
+def serve_properties_data() -> flask.Response:
+    """Ship the columns the clientside callbacks need to the browser as one gzipped Arrow stream. After this the town
+    checklist and year slider don't need the server at all for the location scatter and the violins.
+
+    Returns
+    -------
+    flask.Response
+        Gzipped Arrow IPC stream of CLIENTSIDE_COLUMNS.
+    """
+    response = flask.Response(get_compact_payload(tuple(CLIENTSIDE_COLUMNS)),
+                              mimetype='application/vnd.apache.arrow.stream')
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+
+    return response
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='analysis', function_name='data_loaded'),
+    [Output(component_id='properties_data_loaded', component_property='data'),
+     Output(component_id='properties_data_poll', component_property='disabled')],
+    Input(component_id='properties_data_poll', component_property='n_intervals')
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='analysis', function_name='update_scatter_plot'),
+    Output(component_id='properties_scatter', component_property='figure'),
+    [Input(component_id='properties_to_plot', component_property='value'),
+     Input(component_id='date_range_for_price_data', component_property='value'),
+     Input(component_id='properties_data_loaded', component_property='data'),
+     Input(component_id='properties_scatter', component_property='relayoutData')]  # redraw for what's on screen
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='analysis', function_name='update_violin_plots'),
+    Output(component_id='cost_violins', component_property='figure'),
+    [Input(component_id='date_range_for_price_data', component_property='value'),
+     Input(component_id='properties_to_plot', component_property='value'),
+     Input(component_id='variables_dropdown_2', component_property='value'),
+     Input(component_id='properties_data_loaded', component_property='data')]
+)
+
+
 if __name__ == '__main__':
-    app.run_server()
+    if '--vendor-arrow' in sys.argv:
+        vendor_arrow_js()
+    else:
+        app.run_server()
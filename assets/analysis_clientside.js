@@ -0,0 +1,219 @@
+/*
+Clientside callbacks for analysis_dashboard. The data for the location scatter and the violins gets fetched once as an
+Arrow stream from /data/properties.arrow, and from then on filtering by town / year all happens here in the browser so
+the server doesn't lift a finger when someone clicks a checkbox.
+
+The location scatter also follows the viewport. Each property carries the hierarchical grid cell it sits in (see
+get_grid_cells in data_manipulation.py, the sums here have to match it), so zooming / panning only hands plotly the
+points in cells that are on screen. If there are still too many, they get boiled down to one marker per cell, and the
+real points come back once you've zoomed in far enough. The grid covers the bounds of the data, which come along in the
+Arrow schema metadata, and without them the scatter just shows everything.
+*/
+window.abergavennyData = {columns: null, gridBounds: null, error: null};
+
+fetch('data/properties.arrow')
+    .then(function (response) { return response.arrayBuffer(); })
+    .then(function (buffer) {
+        var bytes = new Uint8Array(buffer);
+        var table = Arrow.tableFromIPC ? Arrow.tableFromIPC(bytes) : Arrow.Table.from(bytes);
+        var columns = {};
+        table.schema.fields.forEach(function (field) {
+            var column = table.getChild ? table.getChild(field.name) : table.getColumn(field.name);
+            columns[field.name] = Array.from(column);  // plain arrays, so nulls come through as null
+        });
+        var gridBounds = table.schema.metadata.get('grid_bounds');
+        window.abergavennyData.gridBounds = gridBounds ? JSON.parse(gridBounds) : null;
+        window.abergavennyData.columns = columns;
+    })
+    .catch(function (error) { window.abergavennyData.error = error; });
+
+
+function requestedRows(columns, towns, dateRange, truePriceOnly) {
+    // indexes of the rows in the chosen towns and years, same as get_requested_df does server side
+    var keepTown = new Set(towns || []);
+    var rows = [];
+    for (var i = 0; i < columns.town.length; i++) {
+        var year = columns.year[i];
+        if (keepTown.has(columns.town[i]) && year >= dateRange[0] && year <= dateRange[1]
+                && (!truePriceOnly || columns.true_price[i])) {
+            rows.push(i);
+        }
+    }
+    return rows;
+}
+
+
+var GRID_LEVELS = 15;  // same as data_manipulation.GRID_LEVELS
+var CELLS_ACROSS_VIEWPORT = 32;  // roughly how many cells wide the viewport should be, picks the level
+var MAX_SCATTER_POINTS = 5000;  // any more than this on screen and they get aggregated per cell
+
+
+function spreadBits(value) {
+    // same as data_manipulation.spread_bits
+    value = (value | (value << 8)) & 0x00FF00FF;
+    value = (value | (value << 4)) & 0x0F0F0F0F;
+    value = (value | (value << 2)) & 0x33333333;
+    return (value | (value << 1)) & 0x55555555;
+}
+
+
+function getViewport(relayoutData) {
+    // visible [lon, lon] and [lat, lat], or null for an axis showing everything
+    function axisRange(axis) {
+        if (!relayoutData) {
+            return null;
+        }
+        if (relayoutData[axis + '.range']) {
+            return relayoutData[axis + '.range'];
+        }
+        if (relayoutData[axis + '.range[0]'] !== undefined) {
+            return [relayoutData[axis + '.range[0]'], relayoutData[axis + '.range[1]']];
+        }
+        return null;
+    }
+    return {lon: axisRange('xaxis'), lat: axisRange('yaxis')};
+}
+
+
+function dataRange(values, rows) {
+    var low = Infinity, high = -Infinity;
+    rows.forEach(function (i) {
+        if (values[i] !== null) {
+            low = Math.min(low, values[i]);
+            high = Math.max(high, values[i]);
+        }
+    });
+    return [low, high];
+}
+
+
+function visibleCells(lonRange, latRange, bounds) {
+    // pick a level where the viewport is about CELLS_ACROSS_VIEWPORT cells wide, and list the cells it covers
+    var width = Math.max(Math.abs(lonRange[1] - lonRange[0]), 1e-9);
+    var level = Math.min(GRID_LEVELS, Math.max(0, Math.ceil(Math.log2(
+        CELLS_ACROSS_VIEWPORT * (bounds[2] - bounds[0]) / width))));
+    var nCells = Math.pow(2, level);
+    function cellIndex(value, low, span) {
+        return Math.min(nCells - 1, Math.max(0, Math.floor((value - low) / span * nCells)));
+    }
+
+    var cells = new Set();
+    var x0 = cellIndex(Math.min.apply(null, lonRange), bounds[0], bounds[2] - bounds[0]);
+    var x1 = cellIndex(Math.max.apply(null, lonRange), bounds[0], bounds[2] - bounds[0]);
+    var y0 = cellIndex(Math.min.apply(null, latRange), bounds[1], bounds[3] - bounds[1]);
+    var y1 = cellIndex(Math.max.apply(null, latRange), bounds[1], bounds[3] - bounds[1]);
+    for (var x = x0; x <= x1; x++) {
+        for (var y = y0; y <= y1; y++) {
+            cells.add((spreadBits(x) << 1) | spreadBits(y));
+        }
+    }
+    return {level: level, shift: 2 * (GRID_LEVELS - level), cells: cells};
+}
+
+
+function pick(values, rows) {
+    return rows.map(function (i) { return values[i]; });
+}
+
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    analysis: {
+        data_loaded: function (n_intervals) {
+            // stop polling once the data has either turned up or failed to
+            var data = window.abergavennyData;
+            if (data.columns) {
+                return [true, true];
+            }
+            if (data.error) {
+                console.error('Could not load properties data', data.error);
+                return [window.dash_clientside.no_update, true];
+            }
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+        },
+
+        update_scatter_plot: function (towns, dateRange, loaded, relayoutData) {
+            if (!loaded) {
+                return window.dash_clientside.no_update;
+            }
+            var columns = window.abergavennyData.columns;
+            var gridBounds = window.abergavennyData.gridBounds;
+            var rows = requestedRows(columns, towns, dateRange, true);
+
+            var viewport = getViewport(relayoutData);
+            var lonRange = viewport.lon || dataRange(columns.longitude, rows);
+            var latRange = viewport.lat || dataRange(columns.latitude, rows);
+            var grid = null;
+            if (gridBounds && rows.length && isFinite(lonRange[0]) && isFinite(latRange[0])) {
+                grid = visibleCells(lonRange, latRange, gridBounds);
+                rows = rows.filter(function (i) { return grid.cells.has(columns.grid_cell[i] >> grid.shift); });
+            }
+            var aggregate = grid !== null && rows.length > MAX_SCATTER_POINTS;
+
+            var traces = {};
+            var cellTotals = {};
+            var order = [];
+            rows.forEach(function (i) {
+                var town = columns.town[i];
+                if (!(town in traces)) {
+                    traces[town] = {type: 'scatter', mode: 'markers', name: town, legendgroup: town, x: [], y: [],
+                                    hovertemplate: 'town=' + town
+                                                   + '<br>longitude=%{x}<br>latitude=%{y}<extra></extra>'};
+                    cellTotals[town] = {};
+                    order.push(town);
+                }
+                if (!aggregate) {
+                    traces[town].x.push(columns.longitude[i]);
+                    traces[town].y.push(columns.latitude[i]);
+                    return;
+                }
+                var cell = columns.grid_cell[i] >> grid.shift;
+                var totals = cellTotals[town][cell] || (cellTotals[town][cell] = {lon: 0, lat: 0, count: 0});
+                totals.lon += columns.longitude[i];
+                totals.lat += columns.latitude[i];
+                totals.count += 1;
+            });
+
+            var data = order.map(function (town) {
+                var trace = traces[town];
+                if (aggregate) {  // one marker per cell at the middle of its points, sized by how many there are
+                    var counts = [];
+                    Object.keys(cellTotals[town]).forEach(function (cell) {
+                        var totals = cellTotals[town][cell];
+                        trace.x.push(totals.lon / totals.count);
+                        trace.y.push(totals.lat / totals.count);
+                        counts.push(totals.count);
+                    });
+                    trace.customdata = counts;
+                    trace.marker = {size: counts.map(function (count) { return 4 + 2 * Math.sqrt(count); }),
+                                    sizemode: 'diameter'};
+                    trace.hovertemplate = 'town=' + town + '<br>sales=%{customdata}<extra></extra>';
+                }
+                return trace;
+            });
+
+            return {
+                data: data,
+                layout: {xaxis: {title: {text: 'longitude'}, range: viewport.lon || undefined},
+                         yaxis: {title: {text: 'latitude'}, range: viewport.lat || undefined},
+                         legend: {title: {text: 'town'}, tracegroupgap: 0},
+                         title: {text: aggregate ? 'Sales per grid cell, zoom in for individual sales' : ''},
+                         uirevision: 'properties_scatter'}  // keep the zoom when the points get swapped out
+            };
+        },
+
+        update_violin_plots: function (dateRange, towns, variable, loaded) {
+            if (!loaded) {
+                return window.dash_clientside.no_update;
+            }
+            var columns = window.abergavennyData.columns;
+            var rows = requestedRows(columns, towns, dateRange, false);
+
+            return {
+                data: [{type: 'violin', x: pick(columns[variable], rows), y: pick(columns.interpolated_price, rows),
+                        hovertemplate: variable + '=%{x}<br>interpolated_price=%{y}<extra></extra>'}],
+                layout: {xaxis: {title: {text: variable}}, yaxis: {title: {text: 'interpolated_price'}},
+                         violinmode: 'group'}
+            };
+        }
+    }
+});
@@ -0,0 +1,332 @@
+"""
+Run the slow dashboard callbacks (lowess trendlines, giant NULL heatmaps etc...) in worker processes rather than inside
+the request thread, so one person dragging a slider doesn't freeze the dashboard for everyone else.
+
+The pattern on the dash side is:
+    - the callback for the inputs submits a job and stashes its ID in a dcc.Store, cancelling whichever job was in
+    there before as nobody wants the figure for where the slider *used* to be.
+    - a dcc.Interval polls the job until it's done, showing progress as it goes, then swaps in the finished figure.
+
+Each job gets a process to itself, started when one of the max_workers slots frees up, so cancelling a running job just
+terminates its process. The heavy bits (fitting the lowess, building the heatmap) are single calls into statsmodels /
+plotly that never come back up for air, so waiting for the job to check in would mean waiting for it to finish.
+
+The processes come from a forkserver rather than being forked straight off the dash server. Forking a threaded server
+copies every lock as it stands at that moment, so if another request happened to be holding one (i.e. the
+property_store table lock while the snapshot is being built) the job would deadlock the first time it went for it.
+The forkserver is a clean single threaded process with the heavy libraries already imported, so forking from it is
+safe and still quick.
+
+Finished jobs hang about until they're collected by a poll, or for RESULT_TTL seconds if nobody ever comes back for
+them (i.e. the tab got closed mid job), after which they're thrown away.
+
+Jobs are tracked in the memory of the server process that took the submit, and aren't shared between processes. The
+property data is (see property_store.py) but the jobs aren't, so run the dashboards as a single (threaded) process, or
+with sticky sessions if there's more than one, otherwise the polls might end up asking a process that never heard of
+the job and it'll look cancelled.
+"""
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from multiprocessing.connection import Connection
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Any, Dict, Optional, Tuple
+import dash
+
+JOB_CONTEXT = multiprocessing.get_context('forkserver')
+JOB_CONTEXT.set_forkserver_preload(['pandas', 'pyarrow', 'plotly.express'])  # so each job doesn't import them afresh
+
+QUEUED, RUNNING, FINISHED, FAILED, CANCELLED = 'queued', 'running', 'finished', 'failed', 'cancelled'
+RESULT_TTL = 600  # seconds to keep a finished job's result about for if it never gets collected
+
+
+class JobCancelled(Exception):
+    """Raised for a job that was cancelled while running."""
+
+
+class ProgressReporter:
+    """Passed into each job so it can report how far along it is.
+
+    Notes
+    -----
+    The dict is a multiprocessing manager proxy, so it can be pickled over to the worker process and written to from
+    there.
+
+    Parameters
+    ----------
+    job_id : ID of the job reporting progress.
+    progress : Shared dict of job ID to (fraction done, message).
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        progress: Dict[str, Any],
+    ):
+        self.job_id = job_id
+        self.progress = progress
+
+    def __call__(
+        self,
+        fraction: float,
+        message: str = '',
+    ) -> None:
+        """Record progress.
+
+        Parameters
+        ----------
+        fraction : How far through the job we are, between 0 and 1.
+        message : What the job is up to.
+        """
+        self.progress[self.job_id] = (fraction, message)
+
+
+def run_job(
+    func: Callable[..., Any],
+    args: Tuple[Any, ...],
+    progress: ProgressReporter,
+    sender: Connection,
+) -> None:
+    """Run a job inside its worker process and send back (True, output), or (False, exception) if it fails.
+
+    Parameters
+    ----------
+    func : Job function.
+    args : Args for func.
+    progress : Reporter for func to record its progress with.
+    sender : Pipe to send the outcome back down.
+    """
+    try:
+        outcome = (True, func(*args, progress=progress))
+    except Exception as e:
+        outcome = (False, e)
+
+    try:
+        sender.send(outcome)
+    except Exception as e:  # output or exception that won't pickle
+        sender.send((False, RuntimeError(repr(e))))
+    finally:
+        sender.close()
+
+
+class JobQueue:
+    """Runs jobs in their own processes, at most max_workers at a time, with a bit of bookkeeping on top to track,
+    cancel and collect them by ID.
+
+    Notes
+    -----
+    Each job is watched over by a thread from a pool of max_workers, which starts the jobs process, waits for it to
+    send back its output and then reaps it. So queueing, running and done all come from that threads future.
+
+    Nothing gets started until the first job is submitted, so importing a dashboard doesn't spin up any idle threads
+    or processes.
+
+    Parameters
+    ----------
+    max_workers : Number of jobs to run at once, defaults to the number of CPUs.
+    result_ttl : Seconds to keep uncollected results for once a job is done.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        result_ttl: float = RESULT_TTL,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.result_ttl = result_ttl
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._cancelled = set()
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._futures: Dict[str, Future] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        if self._executor is None:
+            self._manager = JOB_CONTEXT.Manager()
+            self._progress = self._manager.dict()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+
+    def _run(
+        self,
+        job_id: str,
+        func: Callable[..., Any],
+        args: Tuple[Any, ...],
+    ) -> Any:
+        receiver, sender = JOB_CONTEXT.Pipe(duplex=False)
+        process = JOB_CONTEXT.Process(target=run_job, args=(func, args, ProgressReporter(job_id, self._progress),
+                                                                sender), daemon=True)
+        with self._lock:  # started under the lock so a cancel never finds it half started
+            if job_id in self._cancelled:
+                raise JobCancelled(job_id)
+            process.start()
+            self._processes[job_id] = process
+        sender.close()
+
+        try:
+            succeeded, output = receiver.recv()  # before joining, as a big output would block on the pipe otherwise
+        except EOFError:  # process died without sending anything back, i.e. got terminated by a cancel
+            process.join()
+            succeeded, output = False, (JobCancelled(job_id) if job_id in self._cancelled
+                                        else RuntimeError(f'worker process exited with code {process.exitcode}'))
+        finally:
+            receiver.close()
+            process.join()
+            with self._lock:
+                self._processes.pop(job_id, None)
+
+        if not succeeded:
+            raise output
+
+        return output
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        supersedes: Optional[str] = None,
+    ) -> str:
+        """Queue up a job, which will be called as func(*args, progress=<ProgressReporter>).
+
+        Parameters
+        ----------
+        func : Job function, must be importable at module level so it can be pickled over to the workers.
+        args : Args for func.
+        supersedes : ID of an earlier job this one replaces, which gets cancelled.
+
+        Returns
+        -------
+        str
+            ID of the new job.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._start()
+            self._expire()
+            if supersedes is not None:
+                self._cancel(supersedes)
+            self._progress[job_id] = (0.0, 'Queued')
+            future = self._executor.submit(self._run, job_id, func, args)
+            future.add_done_callback(lambda _: self._finished_at.setdefault(job_id, time.monotonic()))
+            self._futures[job_id] = future
+
+        return job_id
+
+    def _cancel(self, job_id: str) -> None:
+        future = self._futures.pop(job_id, None)
+        if future is None:
+            return
+        if future.done() or future.cancel():  # finished or never started, either way there's nothing to stop
+            self._forget(job_id)
+        else:  # already running, so kill its process off
+            self._cancelled.add(job_id)
+            process = self._processes.get(job_id)
+            if process is not None:
+                process.terminate()
+            future.add_done_callback(lambda _: self._forget(job_id))
+
+    def _forget(self, job_id: str) -> None:
+        self._progress.pop(job_id, None)
+        self._cancelled.discard(job_id)
+        self._finished_at.pop(job_id, None)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id, finished_at in list(self._finished_at.items()):
+            if finished_at < cutoff:
+                self._futures.pop(job_id, None)
+                self._forget(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        """Cancel a job, either before it starts or by terminating its process if it's already running.
+
+        Parameters
+        ----------
+        job_id : ID of the job to cancel.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._cancel(job_id)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """Check on a job. Once a finished or failed job has been checked on it's forgotten about, so each result is
+        only handed out the once, and any left uncollected for longer than result_ttl get forgotten about too.
+
+        Parameters
+        ----------
+        job_id : ID of the job.
+
+        Returns
+        -------
+        Dict[str, Any]
+            'state', 'progress' (fraction done) and 'message', plus 'result' for finished jobs or 'error' for failed
+            ones. Jobs we know nothing about (i.e. cancelled, expired or already collected) come back as cancelled.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._expire()
+            future = self._futures.get(job_id)
+            if future is None:
+                return {'state': CANCELLED, 'progress': 0.0, 'message': 'Cancelled'}
+
+            fraction, message = self._progress.get(job_id, (0.0, ''))
+            if not future.done():
+                state = RUNNING if future.running() else QUEUED
+                return {'state': state, 'progress': fraction, 'message': message}
+
+            del self._futures[job_id]
+            self._forget(job_id)
+
+        error = future.exception()
+        if error is not None:
+            return {'state': FAILED, 'progress': fraction, 'message': message, 'error': repr(error)}
+
+        return {'state': FINISHED, 'progress': 1.0, 'message': 'Done', 'result': future.result()}
+
+
+JOBS = JobQueue()  # one pool per server process, shared by all the dashboards callbacks
+
+
+def handle_job_callback(
+    poll_triggered: bool,
+    job_id: Optional[str],
+    func: Callable[..., Any],
+    *args: Any,
+) -> Tuple[Any, str, Optional[str], bool]:
+    """Do the job side of a dash callback whose inputs are the figure controls plus a polling dcc.Interval, i.e. start
+    a new job when the controls change and check on it when the interval fires.
+
+    Notes
+    -----
+    Dash won't let two callbacks share an output, so submitting and polling have to live in the same callback, which
+    then needs to know which of the two it's doing this time round.
+
+    Parameters
+    ----------
+    poll_triggered : True if the callback was fired by the polling interval rather than the controls.
+    job_id : ID of the current job, from the callbacks dcc.Store.
+    func : Job function to submit when the controls change.
+    args : Args for func, i.e. the control values.
+
+    Returns
+    -------
+    Tuple[Any, str, Optional[str], bool]
+        The figure (or dash.no_update until it's ready), a status message, the job ID to store and whether the polling
+        interval should now be disabled.
+    """
+    if not poll_triggered:
+        return dash.no_update, 'Queued', JOBS.submit(func, *args, supersedes=job_id), False
+
+    status = JOBS.status(job_id)
+    if status['state'] in (QUEUED, RUNNING):
+        return dash.no_update, f"{status['message']} ({status['progress']:.0%})", job_id, False
+    if status['state'] == FAILED:
+        return dash.no_update, f"Failed: {status['error']}", None, True
+    if status['state'] == CANCELLED:
+        return dash.no_update, '', None, True
+
+    return status['result'], '', None, True
@@ -0,0 +1,495 @@
+"""
+Timing and memory bits and bobs for the pipeline, tessellations and dashboards. The real price file for the whole
+country is ~28 million rows so anything that runs once per row needs checking at that kind of size rather than just on
+our little Monmouthshire extract.
+
+Everything runs against synthetic data (see synthetic_data.py) written to a temporary folder, and the results for each
+run get saved as json in data/benchmarks so that we can compare between versions and spot when something has got slow.
+
+Run as a script to benchmark at the default sizes, or i.e. 'python benchmark.py 10000 100000' for specific ones. Add
+'--property-type' to also race the building type classifiers at the national row count, which takes a while and a fair
+bit of RAM mind.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import importlib
+import subprocess
+import contextlib
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Tuple, Iterator, Optional
+import numpy as np
+import pandas as pd
+import engineer_data
+from data_manipulation import create_col_hash
+from synthetic_data import write_synthetic_data, TOWNS
+from input_data import read_csv_with_schema, INPUT_SCHEMAS
+from pipeline_metrics import PeakMemorySampler
+
+NATIONAL_ROW_COUNT = 28_000_000
+DEFAULT_SIZES = [5_000, 20_000, 50_000]  # interpolation alone is ~12s at 20k rows, so anything bigger is an overnighter
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, 'data', 'benchmarks')
+
+
+def legacy_get_property_type(df: pd.DataFrame) -> pd.DataFrame:
+    """The old str.contains per rule version of get_property_type, kept about purely to benchmark against.
+
+    Parameters
+    ----------
+    df : Input dataframe with a 'paon' and a 'saon' column to extract from.
+
+    Returns
+    -------
+    pd.DataFrame
+        Input dataframe with a new 'building_type' column.
+    """
+    rules = [df['paon'].str.contains('BARN', na=False),
+             df['paon'].str.contains('FARM', na=False),
+             df['paon'].str.contains('LAND AT', na=False),
+             df['paon'].str.contains('BUNGALOW', na=False),
+             df['paon'].str.contains('HOTEL', na=False),
+             df['paon'].str.contains(' ARMS', na=False),
+             df['saon'].str.contains('FLAT', na=False)]
+    values = ['Farm', 'Farm', 'Land only', 'Bungalow', 'Hotel', 'Pub', 'Flat']
+
+    df['building_type'] = np.select(rules, values, default='House')
+
+    return df
+
+
+def make_address_df(
+    n_rows: int,
+    n_unique: int = 1_000_000,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Knock up a 'paon' / 'saon' dataframe that looks roughly like the price paid data, i.e. mostly house numbers with
+    some names, flats and farms thrown in, with a lot of repetition.
+
+    Parameters
+    ----------
+    n_rows : Number of rows to generate.
+    n_unique : Rough number of distinct addresses to draw the rows from.
+    seed : Random seed so runs are comparable.
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe with 'paon' and 'saon' columns.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(['', 'THE OLD BARN', 'HILL FARM', 'LAND AT', 'ROSE BUNGALOW', 'ANGEL HOTEL', 'KINGS ARMS',
+                      'IVY COTTAGE', 'THE LODGE'])
+    numbers = rng.integers(1, 300, n_unique).astype(str)
+    paons = np.char.strip(np.char.add(np.char.add(rng.choice(names, n_unique, p=[.85] + [.01875] * 8), ' '), numbers))
+    saons = np.where(rng.random(n_unique) < .1, np.char.add('FLAT ', numbers), None)
+
+    picks = rng.integers(0, n_unique, n_rows)
+
+    return pd.DataFrame({'paon': paons[picks], 'saon': saons[picks]})
+
+
+def time_function(
+    func: Callable[[pd.DataFrame], pd.DataFrame],
+    df: pd.DataFrame,
+) -> float:
+    """Time a single run of some function over a copy of the data.
+
+    Parameters
+    ----------
+    func : Function to time, taking and returning a dataframe.
+    df : Data to pass in, copied first so nothing leaks between runs.
+
+    Returns
+    -------
+    float
+        Wall time in seconds.
+    """
+    df = df.copy()
+    start = time.perf_counter()
+    func(df)
+
+    return time.perf_counter() - start
+
+
+def benchmark_property_type(n_rows: int = NATIONAL_ROW_COUNT) -> Dict[str, float]:
+    """Compare the old and new building type classifiers, checking they agree while we're at it.
+
+    Parameters
+    ----------
+    n_rows : Number of rows to benchmark at.
+
+    Returns
+    -------
+    Dict[str, float]
+        Seconds taken by each version.
+    """
+    df = make_address_df(n_rows)
+
+    legacy = legacy_get_property_type(df.copy())['building_type']
+    compiled = engineer_data.get_property_type(df.copy())['building_type']
+    assert (legacy.values == compiled.values).all(), 'classifiers disagree!'
+
+    return {'legacy_get_property_type': time_function(legacy_get_property_type, df),
+            'get_property_type': time_function(engineer_data.get_property_type, df)}
+
+
+def profile_call(
+    func: Callable[..., Any],
+    make_args: Callable[[], Tuple] = tuple,
+    profile_memory: bool = True,
+) -> Tuple[Any, Dict[str, Any]]:
+    """Time a function call, and then optionally run it a second time to get its peak memory use.
+
+    Notes
+    -----
+    Memory is the peak resident memory of the process over the call less what it was using beforehand. tracemalloc
+    would be more precise but only sees allocations made through python, so misses everything pyarrow and most of what
+    numpy allocate, which for the csv reading and snapshots is nearly all of it. The sampler polls every 10ms, so
+    anything that comes and goes quicker than that can get missed.
+
+    The memory run is separate so that the sampling thread doesn't get in the way of the timings. The args are rebuilt
+    for each run, outside of the timed bit, as loads of our functions change their inputs in place.
+
+    Parameters
+    ----------
+    func : Function to profile.
+    make_args : Function returning a fresh tuple of args to call func with.
+    profile_memory : Set False to skip the memory run, i.e. for the really slow stuff.
+
+    Returns
+    -------
+    Tuple[Any, Dict[str, Any]]
+        Output of the function, and a dictionary of the measurements. If the function fails the error is recorded and
+        the output is None.
+    """
+    stats = {}
+    args = make_args()
+    try:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        output = func(*args)
+        stats['wall_seconds'] = round(time.perf_counter() - wall_start, 4)
+        stats['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+
+        if profile_memory:
+            args = make_args()
+            gc.collect()
+            with PeakMemorySampler() as sampler:
+                baseline = sampler.peak
+                func(*args)
+            stats['peak_memory_mb'] = round((sampler.peak - baseline) / 1024 ** 2, 2)
+
+    except Exception as e:  # one broken stage shouldn't take the rest of the run down with it
+        return None, {'error': repr(e)}
+
+    return output, stats
+
+
+def benchmark_engineering(profile_memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Profile engineering_main end to end and each of the stages within it individually. Needs running from within a
+    folder of synthetic data.
+
+    Parameters
+    ----------
+    profile_memory : Set False to skip measuring peak memory.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Measurements per stage.
+    """
+    results = {}
+
+    postcodes, results['read_postcodes'] = profile_call(engineer_data.read_postcodes, profile_memory=profile_memory)
+    prices, results['read_prices'] = profile_call(engineer_data.read_prices, profile_memory=profile_memory)
+    _, results['read_prices_csv_only'] = profile_call(
+        read_csv_with_schema, lambda: tuple(INPUT_SCHEMAS['prices'].values()), profile_memory=profile_memory)
+    merged, results['merge_postcodes'] = profile_call(
+        engineer_data.merge_postcodes, lambda: (prices, postcodes), profile_memory=profile_memory)
+
+    normalised, results['normalise_address_columns'] = profile_call(
+        engineer_data.normalise_address_columns, lambda: (merged.copy(),), profile_memory=profile_memory)
+    normalised[['postcode', 'paon', 'street']] = normalised[['postcode', 'paon', 'street']].fillna('')
+    _, results['create_col_hash'] = profile_call(
+        lambda df: create_col_hash(df=df, cols_to_hash=(df.postcode + df.paon + df.street)),
+        lambda: (normalised.copy(),), profile_memory=profile_memory)
+    _, results['get_postcode_columns'] = profile_call(
+        engineer_data.get_postcode_columns, lambda: (normalised.copy(),), profile_memory=profile_memory)
+    _, results['get_property_type'] = profile_call(
+        engineer_data.get_property_type, lambda: (normalised.copy(),), profile_memory=profile_memory)
+    basic, results['add_basic_columns'] = profile_call(
+        engineer_data.add_basic_columns, lambda: (merged.copy(),), profile_memory=profile_memory)
+
+    if basic is not None:
+        _, results['interpolate_price_paid'] = profile_call(
+            engineer_data.interpolate_price_paid, lambda: (basic.copy(),), profile_memory=profile_memory)
+
+    _, results['engineering_main'] = profile_call(engineer_data.engineering_main, profile_memory=False)
+    _, results['engineering_main_sequential'] = profile_call(
+        lambda: engineer_data.engineering_main(max_workers=1), profile_memory=False)
+
+    if os.path.exists('data/monmouthshire_properties.csv'):
+        properties = pd.read_csv('data/monmouthshire_properties.csv')
+        supermarket_cols = ['supermarkets_in_area', 'supermarkets_in_district', 'supermarkets_in_sector',
+                            'distance_to_closest_supermarket', 'closest_store', 'number_stores_in_radius']
+        properties.drop(supermarket_cols, axis=1, inplace=True)
+        _, results['get_supermarket_stats'] = profile_call(
+            engineer_data.get_supermarket_stats, lambda: (properties.copy(),), profile_memory=profile_memory)
+        _, results['get_neighbour_price_features'] = profile_call(
+            engineer_data.get_neighbour_price_features, lambda: (properties.copy(),), profile_memory=profile_memory)
+
+    return results
+
+
+def benchmark_tessellation(profile_memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Profile building each level of voronoi tessellation. Needs running after benchmark_engineering, from within the
+    same folder of synthetic data.
+
+    Parameters
+    ----------
+    profile_memory : Set False to skip measuring peak memory.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Measurements per tessellation level, or a single 'skipped' entry if geopandas / shapely aren't installed.
+    """
+    try:
+        import construct_polygons  # geopandas is a pain to install so dont make the rest of the benchmarks need it
+    except ImportError as e:
+        return {'create_voronoi_tessellation': {'skipped': repr(e)}}
+
+    os.makedirs('data/polygons', exist_ok=True)
+    df = pd.read_csv('data/monmouthshire_properties.csv')
+
+    results = {}
+    for file_name, (point_set, longitude, latitude) in construct_polygons.get_tessellation_point_sets(df).items():
+        _, results[f'create_voronoi_tessellation.{file_name}'] = profile_call(
+            construct_polygons.create_voronoi_tessellation,
+            lambda: (point_set.copy(), file_name, longitude, latitude),
+            profile_memory=profile_memory)
+
+    return results
+
+
+def get_callback(module: Any, name: str) -> Callable[..., Any]:
+    """Get the undecorated version of a dash callback, as the decorated one wants to be called by the dash server.
+
+    Parameters
+    ----------
+    module : Dashboard module holding the callback.
+    name : Name of the callback function.
+
+    Returns
+    -------
+    Callable[..., Any]
+        The plain python function underneath the callback.
+    """
+    callback = getattr(module, name)
+
+    return getattr(callback, '__wrapped__', callback)
+
+
+def load_module(name: str) -> Any:
+    """Import a module fresh, reloading it if its already been imported so it reads in the current folders data.
+
+    Parameters
+    ----------
+    name : Name of the module.
+
+    Returns
+    -------
+    Any
+        The imported module.
+    """
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)  # we'll be sat in some temp folder so it might not find them otherwise
+
+    if name in sys.modules:
+        return importlib.reload(sys.modules[name])
+
+    return importlib.import_module(name)
+
+
+def report_no_progress(
+    fraction: float,
+    message: str = '',
+) -> None:
+    """Stand in for the background job progress reporter, for calling the slow figure builders directly."""
+
+
+def benchmark_dashboards(profile_memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Profile importing each dashboard and then each of their callbacks with typical inputs. Needs running after
+    benchmark_engineering, from within the same folder of synthetic data.
+
+    Parameters
+    ----------
+    profile_memory : Set False to skip measuring peak memory.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Measurements per dashboard import and callback.
+    """
+    results = {}
+    callback_inputs = {
+        'analysis_dashboard': {
+            'serve_properties_data': (),
+            'build_cost_scatter': ([2010, 2020], TOWNS, 'altitude', report_no_progress),
+            'update_price_surface': (2015, None),
+        },
+        'validation_dashboard': {
+            'get_file_shape_table': ('Complete',),
+            'get_variable_info_table': (['Variable Name'], 'Complete'),
+            'update_null_bar_chart': ('Complete',),
+            'build_null_heatmap': ('Complete', report_no_progress),
+        },
+    }
+
+    load_module('property_store')  # drop any table left memory mapped from a previous size
+    for module_name, callbacks in callback_inputs.items():
+        module, results[f'{module_name}.import'] = profile_call(load_module, lambda: (module_name,),
+                                                                profile_memory=False)
+        if module is None:
+            continue
+
+        for callback_name, args in callbacks.items():
+            _, results[f'{module_name}.{callback_name}'] = profile_call(
+                get_callback(module, callback_name), lambda: args, profile_memory=profile_memory)
+
+    return results
+
+
+@contextlib.contextmanager
+def synthetic_workdir(
+    n_rows: int,
+    seed: int = 0,
+) -> Iterator[str]:
+    """Write a set of synthetic data into a temporary folder and move into it for the duration, tidying up after.
+
+    Parameters
+    ----------
+    n_rows : Number of rows in the synthetic price file.
+    seed : Random seed.
+
+    Returns
+    -------
+    Iterator[str]
+        Path of the temporary folder.
+    """
+    original_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='abergavenny_benchmark_')
+    try:
+        write_synthetic_data(workdir, n_rows, seed=seed)
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def get_code_version() -> str:
+    """Get the current git commit, so results can be tied back to the code that produced them.
+
+    Returns
+    -------
+    str
+        Short commit hash, with '-dirty' on the end if there are uncommitted changes, or 'unknown' outside of git.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(
+    sizes: Optional[List[int]] = None,
+    profile_memory: bool = True,
+    include_tessellation: bool = True,
+    include_dashboards: bool = True,
+    include_property_type: bool = False,
+) -> str:
+    """Run the whole benchmark suite at each size and save the results to a json in data/benchmarks.
+
+    Parameters
+    ----------
+    sizes : Row counts of synthetic price data to benchmark at. Defaults to DEFAULT_SIZES.
+    profile_memory : Set False to skip measuring peak memory, roughly halves the run time.
+    include_tessellation : Set False to skip the tessellation benchmarks, i.e. if geopandas isn't installed.
+    include_dashboards : Set False to skip the dashboard benchmarks.
+    include_property_type : Set True to also compare the building type classifiers at NATIONAL_ROW_COUNT rows. Off by
+        default as it needs a machine with plenty of memory.
+
+    Returns
+    -------
+    str
+        Path to the saved results.
+    """
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    version = get_code_version()
+    output = {'version': version, 'timestamp': datetime.now().isoformat(timespec='seconds'), 'runs': []}
+
+    for n_rows in sizes:
+        with synthetic_workdir(n_rows):
+            results = benchmark_engineering(profile_memory)
+            if include_tessellation:
+                results.update(benchmark_tessellation(profile_memory))
+            if include_dashboards:
+                results.update(benchmark_dashboards(profile_memory))
+
+        output['runs'].append({'n_rows': n_rows, 'results': results})
+
+    if include_property_type:  # saved as a run of its own, in the same shape so compare_benchmarks can line it up
+        seconds = benchmark_property_type(NATIONAL_ROW_COUNT)
+        output['runs'].append({'n_rows': NATIONAL_ROW_COUNT,
+                               'results': {name: {'wall_seconds': round(value, 4)} for name, value in seconds.items()}})
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{version}.json")
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+
+    return path
+
+
+def compare_benchmarks(
+    old_path: str,
+    new_path: str,
+    metric: str = 'wall_seconds',
+) -> pd.DataFrame:
+    """Line up two sets of saved benchmark results to see what's got faster or slower.
+
+    Parameters
+    ----------
+    old_path : Path to the earlier results json.
+    new_path : Path to the later results json.
+    metric : Which measurement to compare.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per size and stage, with the old and new values and new / old ratio. Ratios over 1 are regressions.
+    """
+    frames = []
+    for label, path in [('old', old_path), ('new', new_path)]:
+        with open(path) as f:
+            runs = json.load(f)['runs']
+        frames.append(pd.DataFrame([{'n_rows': run['n_rows'], 'stage': stage, label: stats.get(metric)}
+                                    for run in runs
+                                    for stage, stats in run['results'].items()]))
+
+    comparison = frames[0].merge(frames[1], on=['n_rows', 'stage'], how='outer')
+    comparison['ratio'] = comparison['new'] / comparison['old']
+
+    return comparison.sort_values(['n_rows', 'ratio'], ascending=[True, False])
+
+
+if __name__ == '__main__':
+    print(run_benchmarks([int(arg) for arg in sys.argv[1:] if arg != '--property-type'] or None,
+                         include_property_type='--property-type' in sys.argv))
@@ -5,7 +5,10 @@ TODO - figure out what to do about the rim of the region
      - figure out what to do about the bounding polygons - do they actually matter tbf? <- yes, especially for less
      gritty bits and bobs
 """
+import numpy as np
 import pandas as pd
+from typing import Dict, Tuple
+from scipy import sparse
 from scipy.spatial import Voronoi
 from shapely import geometry, ops
 import geopandas as gpd
@@ -57,13 +60,85 @@ def get_tesselation_ids(
     return polygons
 
 
+def get_adjacency_matrix(tessellation: Voronoi) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Work out which cells of a voronoi tessellation neighbour each other, straight from the ridges qhull already found
+    rather than checking every pair of polygons for whether they touch.
+
+    Notes
+    -----
+    Each ridge is the edge shared by the cells of the two points in ridge_points, so the adjacency is just those pairs
+    both ways round, i.e. linear in the number of points. Ridges heading off to infinity still count, as the cells
+    around the rim really do share them even if their polygons get dropped by polygonize.
+    Points sitting on top of each other (i.e. every property in the same postcode) share a single cell, so the matrix is
+    per cell rather than per point, and cell_of_point says which cell each point ended up in.
+
+    Parameters
+    ----------
+    tessellation : Voronoi tessellation of the points.
+
+    Returns
+    -------
+    Tuple[sparse.csr_matrix, np.ndarray]
+        Symmetric 0 / 1 adjacency matrix of the cells, and the row of the matrix for each input point.
+    """
+    _, cell_of_point = np.unique(tessellation.point_region, return_inverse=True)
+    n_cells = cell_of_point.max() + 1
+
+    ridges = cell_of_point[tessellation.ridge_points]
+    rows = np.concatenate([ridges[:, 0], ridges[:, 1]])
+    cols = np.concatenate([ridges[:, 1], ridges[:, 0]])
+
+    adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_cells, n_cells))
+    adjacency.data[:] = 1  # in case any pair of cells turned up in more than one ridge
+
+    return adjacency, cell_of_point
+
+
+def save_adjacency(
+    adjacency: sparse.csr_matrix,
+    cell_of_point: np.ndarray,
+    ids: pd.Index,
+    file_name: str,
+) -> None:
+    """Save an adjacency matrix next to its polygons, along with which cell (row of the matrix) each ID lives in.
+
+    Parameters
+    ----------
+    adjacency : Adjacency matrix from get_adjacency_matrix.
+    cell_of_point : Row of the matrix for each point, from get_adjacency_matrix.
+    ids : IDs of the points, in the order they went into the tessellation.
+    file_name : Name the polygons were saved under.
+    """
+    sparse.save_npz(f'data/polygons/{file_name}_adjacency.npz', adjacency)
+    pd.DataFrame({ids.name or 'id': ids, 'cell': cell_of_point}).to_csv(f'data/polygons/{file_name}_adjacency_ids.csv',
+                                                                        index=False)
+
+
+def load_adjacency(file_name: str) -> Tuple[sparse.csr_matrix, pd.DataFrame]:
+    """Read back an adjacency matrix saved by create_voronoi_tessellation.
+
+    Parameters
+    ----------
+    file_name : Name the polygons were saved under, i.e. 'postcode_sector_polygons'.
+
+    Returns
+    -------
+    Tuple[sparse.csr_matrix, pd.DataFrame]
+        Adjacency matrix of the cells, and the ID to cell mapping.
+    """
+    adjacency = sparse.load_npz(f'data/polygons/{file_name}_adjacency.npz').tocsr()
+
+    return adjacency, pd.read_csv(f'data/polygons/{file_name}_adjacency_ids.csv')
+
+
 def create_voronoi_tessellation(
     point_set: pd.DataFrame,
     file_name: str,
     longitude: str,
     latitude: str,
 ) -> None:
-    """Create a shapefile for the resultant polygons when calculating a voronoi tessellation out of an input point set.
+    """Create a shapefile for the resultant polygons when calculating a voronoi tessellation out of an input point set,
+    plus a sparse adjacency matrix of which polygons neighbour which.
 
     Notes
     -----
@@ -78,7 +153,10 @@ def create_voronoi_tessellation(
     longitude : Column name of longitude variable in point_set df.
     latitude : Column name of latitude variable in point_set df.
     """
-    tessellation = Voronoi(point_set)
+    tessellation = Voronoi(point_set[[longitude, latitude]])
+    adjacency, cell_of_point = get_adjacency_matrix(tessellation)
+    save_adjacency(adjacency, cell_of_point, point_set.index, file_name)
+
     edges = [geometry.LineString(tessellation.vertices[line])
              for line in tessellation.ridge_vertices
              if -1 not in line]  # taken from a helpful stack overflow comment
@@ -96,19 +174,43 @@ def create_voronoi_tessellation(
                      index=False)
 
 
-df = pd.read_csv('data/monmouthshire_properties.csv')
-df = df[['longitude', 'latitude', 'property_id',
-         'postcode_sector_longitude', 'postcode_sector_latitude', 'postcode_sector',
-         'postcode_district_longitude', 'postcode_district_latitude', 'postcode_district']].drop_duplicates()
-df.dropna(axis=0, inplace=True)
-test = df[['longitude', 'latitude', 'property_id']].drop_duplicates()
-test.set_index('property_id', inplace=True)
-create_voronoi_tessellation(test, 'postcode_polygons', 'longitude', 'latitude')
+def get_tessellation_point_sets(df: pd.DataFrame) -> Dict[str, Tuple[pd.DataFrame, str, str]]:
+    """Pull out the unique points to build each level of tessellation around from the engineered data.
+
+    Parameters
+    ----------
+    df : Engineered property data.
+
+    Returns
+    -------
+    Dict[str, Tuple[pd.DataFrame, str, str]]
+        Dictionary of file name to (point set, longitude column, latitude column), ready for
+        create_voronoi_tessellation.
+    """
+    df = df[['longitude', 'latitude', 'property_id',
+             'postcode_sector_longitude', 'postcode_sector_latitude', 'postcode_sector',
+             'postcode_district_longitude', 'postcode_district_latitude', 'postcode_district']].drop_duplicates()
+    df.dropna(axis=0, inplace=True)
+
+    point_sets = {}
+    for file_name, id_col, prefix in [('postcode_polygons', 'property_id', ''),
+                                      ('postcode_sector_polygons', 'postcode_sector', 'postcode_sector_'),
+                                      ('postcode_district_polygons', 'postcode_district', 'postcode_district_')]:
+        longitude, latitude = f'{prefix}longitude', f'{prefix}latitude'
+        point_set = df[[longitude, latitude, id_col]].drop_duplicates()
+        point_set.set_index(id_col, inplace=True)
+        point_sets[file_name] = (point_set, longitude, latitude)
+
+    return point_sets
+
+
+def polygons_main() -> None:
+    """Build the tessellations at postcode, postcode sector and postcode district level from the engineered data."""
+    df = pd.read_csv('data/monmouthshire_properties.csv')
+
+    for file_name, (point_set, longitude, latitude) in get_tessellation_point_sets(df).items():
+        create_voronoi_tessellation(point_set, file_name, longitude, latitude)
 
-test = df[['postcode_sector_longitude', 'postcode_sector_latitude', 'postcode_sector']].drop_duplicates()
-test.set_index('postcode_sector', inplace=True)
-create_voronoi_tessellation(test, 'postcode_sector_polygons', 'postcode_sector_longitude', 'postcode_sector_latitude')
 
-test = df[['postcode_district_longitude', 'postcode_district_latitude', 'postcode_district']].drop_duplicates()
-test.set_index('postcode_district', inplace=True)
-create_voronoi_tessellation(test, 'postcode_district_polygons', 'postcode_district_longitude', 'postcode_district_latitude')
+if __name__ == '__main__':
+    polygons_main()
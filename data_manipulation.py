@@ -6,8 +6,72 @@ should think again about building that generic John functions package just for e
 import pandas as pd
 import numpy as np
 import re
+import os
 import hashlib
-from typing import Tuple, Dict, Any
+import pyarrow as pa
+from functools import lru_cache
+from typing import Tuple, Dict, Any, Callable, Pattern, Optional, List
+
+ADDRESS_PUNCTUATION = {
+    '.': '',
+    "'": '',
+    ',': ' ',
+    '-': ' ',
+    '/': ' ',
+    '&': ' AND ',
+}
+ADDRESS_ABBREVIATIONS = {
+    'RD': 'ROAD',
+    'ST': 'STREET',
+    'AVE': 'AVENUE',
+    'AV': 'AVENUE',
+    'CL': 'CLOSE',
+    'CRES': 'CRESCENT',
+    'CT': 'COURT',
+    'DR': 'DRIVE',
+    'GDNS': 'GARDENS',
+    'GRN': 'GREEN',
+    'LN': 'LANE',
+    'PL': 'PLACE',
+    'SQ': 'SQUARE',
+    'TER': 'TERRACE',
+    'TERR': 'TERRACE',
+    'COTT': 'COTTAGE',
+    'COTTS': 'COTTAGES',
+    'HO': 'HOUSE',
+}
+GRID_LEVELS = 15  # bits per axis of the grid cell keys, 30 bits in all so they still fit in an int32 for the browser
+GRID_BOUNDS_FILE = 'data/metadata/grid_bounds.json'  # bounds the grid cell keys were last worked out over
+
+
+def map_over_uniques(
+    column: pd.Series,
+    func: Callable[[np.ndarray], np.ndarray],
+    fill_value: Any = np.nan,
+) -> np.ndarray:
+    """Apply some function to only the unique values of a column and broadcast the results back out to every row.
+
+    Notes
+    -----
+    Address columns repeat the same handful of strings tens of thousands of times, so doing the expensive bit once per
+    distinct value and then indexing back out is loads quicker than doing it once per row. NULLs are never passed to
+    func, they just come back out as fill_value.
+
+    Parameters
+    ----------
+    column : Column to apply the function over.
+    func : Function taking an array of unique non-null values and returning an array of results of equal length.
+    fill_value : Value returned for rows where the column is NULL.
+
+    Returns
+    -------
+    np.ndarray
+        Array of results, one per row of the input column.
+    """
+    codes, uniques = pd.factorize(column)
+    results = np.asarray(func(np.asarray(uniques)))
+
+    return np.append(results, [fill_value])[codes]  # NULLs have a code of -1 so pick up the fill_value on the end
 
 
 def create_col_hash(
@@ -26,14 +90,37 @@ def create_col_hash(
     pd.DataFrame
         Dataframe with extra 'bout_id' column.
     """
-    df['property_id'] = (
-        cols_to_hash
-        .apply(lambda x: hashlib.md5(x.encode('utf-8')).hexdigest())
-    )
+    df['property_id'] = map_over_uniques(
+        cols_to_hash,
+        lambda uniques: np.array([hashlib.md5(x.encode('utf-8')).hexdigest() for x in uniques], dtype=object),
+        fill_value=None,
+    )  # each property turns up once per sale so only hash the distinct ones
 
     return df
 
 
+@lru_cache(maxsize=None)
+def compile_replacements(to_replace: Tuple[str, ...]) -> Pattern:
+    """Compile the single pass regex used by replace_multiple, cached so that calling it over and over with the same
+    replacements doesn't rebuild the same pattern every time.
+
+    Notes
+    -----
+    Longer keys go first so that i.e. '  ' gets a chance to match before ' ' does, otherwise which one wins would
+    depend on dictionary order.
+
+    Parameters
+    ----------
+    to_replace : Tuple of the literal strings to be replaced.
+
+    Returns
+    -------
+    Pattern
+        Compiled regex matching any of the input strings.
+    """
+    return re.compile('|'.join(re.escape(k) for k in sorted(to_replace, key=len, reverse=True)))
+
+
 def replace_multiple(
     text: str,
     replacements: Dict[str, str],
@@ -59,9 +146,8 @@ def replace_multiple(
         Text but with the requested replacements made.
     """
     if simultaneous:
-        replacements = dict((re.escape(k), v) for k, v in replacements.items())
-        pattern = re.compile("|".join(replacements.keys()))
-        text = pattern.sub(lambda m: replacements[re.escape(m.group(0))], text)
+        pattern = compile_replacements(tuple(replacements.keys()))
+        text = pattern.sub(lambda m: replacements[m.group(0)], text)
 
     else:
         for i, j in replacements.items():
@@ -70,6 +156,77 @@ def replace_multiple(
     return text
 
 
+def normalise_address(
+    text: str,
+    punctuation: Optional[Dict[str, str]] = None,
+    abbreviations: Optional[Dict[str, str]] = None,
+) -> str:
+    """Squash formatting differences out of a line of an address, so that i.e. 'Flat 1, 12a High St.' and
+    'FLAT 1 12A HIGH STREET' come out the same.
+
+    Notes
+    -----
+    Abbreviations only get expanded when they're the last word, as thats where the road type lives and it stops
+    'ST MARYS ROAD' turning into 'STREET MARYS ROAD'.
+
+    Parameters
+    ----------
+    text : Address text to normalise.
+    punctuation : Dictionary of punctuation - replacement pairs, defaults to ADDRESS_PUNCTUATION.
+    abbreviations : Dictionary of abbreviation - full word pairs, defaults to ADDRESS_ABBREVIATIONS.
+
+    Returns
+    -------
+    str
+        Upper case address with punctuation removed, single spaced and with any trailing abbreviation expanded.
+    """
+    punctuation = ADDRESS_PUNCTUATION if punctuation is None else punctuation
+    abbreviations = ADDRESS_ABBREVIATIONS if abbreviations is None else abbreviations
+
+    words = replace_multiple(text=text.upper(), replacements=punctuation, simultaneous=True).split()
+    if words:
+        words[-1] = abbreviations.get(words[-1], words[-1])
+
+    return ' '.join(words)
+
+
+def normalise_postcode(text: str) -> str:
+    """Put a postcode into the standard 'outward inward' format, i.e. 'np75aa' -> 'NP7 5AA'.
+
+    Parameters
+    ----------
+    text : Postcode to normalise.
+
+    Returns
+    -------
+    str
+        Upper case postcode with a single space before the last three characters.
+    """
+    text = ''.join(text.upper().split())
+
+    return f'{text[:-3]} {text[-3:]}' if len(text) > 3 else text
+
+
+def normalise_column(
+    column: pd.Series,
+    normaliser: Callable[[str], str],
+) -> np.ndarray:
+    """Normalise a text column by running the normaliser over its unique values only.
+
+    Parameters
+    ----------
+    column : Text column to normalise.
+    normaliser : Function normalising a single string.
+
+    Returns
+    -------
+    np.ndarray
+        Normalised column, NULLs are left as NULLs.
+    """
+    return map_over_uniques(column, lambda uniques: np.array([normaliser(str(x)) for x in uniques], dtype=object),
+                            fill_value=None)
+
+
 def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
     """Clean column headers of capitals, punctuation, etc...
 
@@ -111,3 +268,87 @@ def convert_column_to_boolean(
         Series of dtype bool.
     """
     return np.where(column == true_value, True, False)
+
+
+def write_arrow_file(
+    table: pa.Table,
+    path: str,
+) -> None:
+    """Write an arrow table to an uncompressed Arrow IPC file, which can later be memory mapped straight back in.
+
+    Notes
+    -----
+    Written to a temp file first and then swapped in, so anything opening it at the same time never sees half a file.
+
+    Parameters
+    ----------
+    table : Table to write.
+    path : Path to write it to.
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    """Space out the bits of (up to 16 bit) ints with a zero between each, i.e. 0b111 -> 0b10101, ready to interleave.
+
+    Parameters
+    ----------
+    values : Non negative ints below 2 ** 16.
+
+    Returns
+    -------
+    np.ndarray
+        The spread out bits.
+    """
+    values = values.astype(np.int64)
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    values = (values | (values << 1)) & 0x55555555
+
+    return values
+
+
+def get_grid_cells(
+    longitude: pd.Series,
+    latitude: pd.Series,
+    bounds: List[float],
+    levels: int = GRID_LEVELS,
+) -> pd.Series:
+    """Key each point by the cell it falls in on a hierarchical grid over the bounds, geohash style. Each level halves
+    the cells in both directions, and the key interleaves the longitude and latitude bits (longitude first), so the
+    cell a point sits in at any coarser level L is just key >> 2 * (levels - L), and nearby points share prefixes.
+
+    Notes
+    -----
+    Over the bounds of the data rather than the whole globe, otherwise our bit of Wales is under 1/500th of the width
+    of the grid and even the whole county on screen is already down at the finest level. Which means the keys are only
+    any use alongside the bounds they were made with, so those get saved to GRID_BOUNDS_FILE and shipped to the browser
+    with them. assets/analysis_clientside.js does the same sums for the viewport, so change both together.
+
+    Parameters
+    ----------
+    longitude : Longitude of each point.
+    latitude : Latitude of each point.
+    bounds : [min longitude, min latitude, max longitude, max latitude] of the grid, anything outside is put in the
+        nearest edge cell.
+    levels : Number of levels, i.e. bits per axis.
+
+    Returns
+    -------
+    pd.Series
+        Cell key per point, -1 where the location is unknown.
+    """
+    n_cells = 2 ** levels
+    known = longitude.notnull() & latitude.notnull()
+    x = ((longitude[known] - bounds[0]) / (bounds[2] - bounds[0]) * n_cells).astype(np.int64).clip(0, n_cells - 1)
+    y = ((latitude[known] - bounds[1]) / (bounds[3] - bounds[1]) * n_cells).astype(np.int64).clip(0, n_cells - 1)
+
+    cells = pd.Series(-1, index=longitude.index, dtype=np.int64)
+    cells[known] = (spread_bits(x.to_numpy()) << 1) | spread_bits(y.to_numpy())
+
+    return cells
@@ -6,21 +6,39 @@ these include:
     - creating a unique property ID based on postcode, house number and road name.
     - interpolating the probable value of the property in years between sales.
     - adding info on distance to and brand of closest supermarket.
+    - rasterising the prices into map tiles for the dashboard.
     - *extracting a bunch of extra info from some columns*
 
 *text* = not yet but will do soon lol.
 
 TODO: - add extra data such as distance from centroids / etc...
 """
+import os
+import re
+import sys
+import json
 import pandas as pd
 import numpy as np
-from functools import reduce
+from typing import List, Tuple, Pattern, Optional, Dict, Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from data_manipulation import (
+    map_over_uniques,
+    normalise_column,
+    normalise_address,
+    normalise_postcode,
     create_col_hash,
     clean_column_names,
     convert_column_to_boolean,
+    get_grid_cells,
+    GRID_BOUNDS_FILE,
 )
+from pipeline_metrics import PipelineMetrics, track_step
+from pipeline_dag import Stage, run_dag
+from property_store import write_properties_snapshot
+from input_data import load_input
+from price_tiles import build_price_tiles, get_region_bounds
 
 
 def interpolate_price_paid(df: pd.DataFrame) -> pd.DataFrame:
@@ -87,28 +105,114 @@ def get_postcode_columns(
     return df
 
 
-def get_property_type(df: pd.DataFrame) -> pd.DataFrame:
+def load_building_type_rules(rules_file: str = 'data/metadata/building_type_rules.csv') -> List[Tuple[str, str, str]]:
+    """Read the building type rules in from file so new ones can be added without touching the code.
+
+    Parameters
+    ----------
+    rules_file : Path to a csv with 'column', 'pattern' and 'building_type' columns. Rules higher up the file take
+        priority over those further down.
+
+    Returns
+    -------
+    List[Tuple[str, str, str]]
+        List of (column, regex pattern, building type) rules, in priority order.
+    """
+    rules = pd.read_csv(rules_file, dtype=str, keep_default_na=False)
+
+    return list(rules[['column', 'pattern', 'building_type']].itertuples(index=False, name=None))
+
+
+def compile_rule_pattern(patterns: List[str]) -> Pattern:
+    """Combine a load of patterns into one regex which reports back the first of them to match, in list order.
+
+    Notes
+    -----
+    Each pattern sits in a lookahead anchored to the start of the string, followed by an empty group named after its
+    position in the list. Alternation is tried left to right so the group that ends up as 'lastgroup' is the highest
+    priority rule which matched anywhere in the string, same as np.select would have given us.
+
+    Parameters
+    ----------
+    patterns : List of regex patterns in priority order.
+
+    Returns
+    -------
+    Pattern
+        Compiled regex, whose match objects have lastgroup set to 'rule_<i>' for the winning pattern.
+    """
+    return re.compile('|'.join(f'(?=.*?(?:{pattern}))(?P<rule_{i}>)' for i, pattern in enumerate(patterns)),
+                      flags=re.DOTALL)
+
+
+def classify_column(
+    column: pd.Series,
+    patterns: List[str],
+    rule_ranks: List[int],
+    no_match: int,
+) -> np.ndarray:
+    """Find the highest priority rule matching each row of a column, scanning each unique value once only.
+
+    Parameters
+    ----------
+    column : Column of strings to classify.
+    patterns : Regex patterns which apply to this column, in priority order.
+    rule_ranks : Overall priority of each pattern across all of the rules.
+    no_match : Rank to give rows that match nothing (or are NULL).
+
+    Returns
+    -------
+    np.ndarray
+        Rank of the winning rule for each row.
+    """
+    pattern = compile_rule_pattern(patterns)
+    ranks = np.array(rule_ranks + [no_match])
+
+    def rank_uniques(uniques: np.ndarray) -> np.ndarray:
+        matches = [pattern.match(str(value)) for value in uniques]
+        return ranks[[int(match.lastgroup[5:]) if match else -1 for match in matches]]
+
+    return map_over_uniques(column, rank_uniques, fill_value=no_match).astype(int)
+
+
+def get_property_type(
+    df: pd.DataFrame,
+    rules: Optional[List[Tuple[str, str, str]]] = None,
+    default: str = 'House',
+) -> pd.DataFrame:
     """Extract property type from the 'paon' and 'saon' columns. wonder what 'paon' and 'saon' even mean...
 
+    Notes
+    -----
+    Used to be a str.contains per rule, which meant another full scan of the data for every rule we added. Now the rules
+    for each column are squashed into one regex and only run against the unique addresses, of which there are far
+    fewer than there are rows.
+
     Parameters
     ----------
     df : Input dataframe with a 'paon' and a 'saon' column to extract from.
+    rules : List of (column, pattern, building type) rules in priority order. Read from the default rules file if None.
+    default : Building type for anything that matches no rules.
 
     Returns
     -------
     pd.DataFrame
         Input dataframe with a new 'building_type' column.
     """
-    rules = [df['paon'].str.contains('BARN', na=False),
-             df['paon'].str.contains('FARM', na=False),
-             df['paon'].str.contains('LAND AT', na=False),
-             df['paon'].str.contains('BUNGALOW', na=False),
-             df['paon'].str.contains('HOTEL', na=False),
-             df['paon'].str.contains(' ARMS', na=False),
-             df['saon'].str.contains('FLAT', na=False)]
-    values = ['Farm', 'Farm', 'Land only', 'Bungalow', 'Hotel', 'Pub', 'Flat']
+    if rules is None:
+        rules = load_building_type_rules()
+
+    no_match = len(rules)
+    best_rank = np.full(len(df), no_match)
+    for column in dict.fromkeys(rule[0] for rule in rules):  # keeps the column order of the rules
+        column_rules = [(rank, pattern) for rank, (col, pattern, _) in enumerate(rules) if col == column]
+        best_rank = np.minimum(best_rank, classify_column(column=df[column],
+                                                          patterns=[pattern for _, pattern in column_rules],
+                                                          rule_ranks=[rank for rank, _ in column_rules],
+                                                          no_match=no_match))
 
-    df['building_type'] = np.select(rules, values, default='House')  # assume all else is residences
+    values = np.array([rule[2] for rule in rules] + [default], dtype=object)
+    df['building_type'] = values[best_rank]  # assume all else is residences
 
     return df
 
@@ -128,8 +232,7 @@ def get_supermarket_stats(df: pd.DataFrame) -> pd.DataFrame:
         Input data but with supermarket info added on in a few ways. Don't ask what ways though. Can you tell I wrote
         the docstring before the function. Because I didn't. just lazy.
     """
-    supermarket_df = pd.read_csv('data/geolityx_supermarkets_locations.csv')
-    supermarket_df = supermarket_df[supermarket_df['county'].isin(['Gwent', 'Powys'])]
+    supermarket_df = load_input('supermarkets', filters={'county': ['Gwent', 'Powys']})
 
     supermarket_df['postcode_area'] = supermarket_df['postcode'].str.extract(r'([a-zA-Z ]*)\d*.*')  # i.e. 'CF'
     supermarket_df['postcode_district'] = supermarket_df['postcode'].str.split().str[0]  # i.e. 'CF14'
@@ -161,15 +264,260 @@ def get_supermarket_stats(df: pd.DataFrame) -> pd.DataFrame:
     stores_in_radius = pd.DataFrame(stores_in_radius.sum(axis=1)).reset_index().drop_duplicates()
     stores_in_radius.columns = ['property_id', 'number_stores_in_radius']
 
-    counts_list = [df,
-                   supermarket_df[['postcode_area', 'supermarkets_in_area']].drop_duplicates(),
-                   supermarket_df[['postcode_district', 'supermarkets_in_district']].drop_duplicates(),
-                   supermarket_df[['postcode_sector', 'supermarkets_in_sector']].drop_duplicates(),
-                   closest_dist,
-                   closest_store,
-                   stores_in_radius]
+    counts_list = [('supermarkets_in_area',
+                    supermarket_df[['postcode_area', 'supermarkets_in_area']].drop_duplicates()),
+                   ('supermarkets_in_district',
+                    supermarket_df[['postcode_district', 'supermarkets_in_district']].drop_duplicates()),
+                   ('supermarkets_in_sector',
+                    supermarket_df[['postcode_sector', 'supermarkets_in_sector']].drop_duplicates()),
+                   ('distance_to_closest_supermarket', closest_dist),
+                   ('closest_store', closest_store),
+                   ('number_stores_in_radius', stores_in_radius)]
 
-    df = reduce(lambda left, right: pd.merge(left, right, how='left'), counts_list)
+    for name, right in counts_list:
+        df = track_step(f'merge_{name}', pd.merge, df, right, how='left')
+
+    return df
+
+
+def project_to_km(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+) -> np.ndarray:
+    """Flatten long / lat onto a rough km grid, so that euclidean distance between points is about right in km.
+
+    Notes
+    -----
+    Equirectangular projection about the middle latitude of the points. Over an area the size of a county the error is
+    a fraction of a percent, which is plenty good enough for picking out neighbours.
+
+    Parameters
+    ----------
+    latitude : Latitudes in degrees.
+    longitude : Longitudes in degrees.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n, 2) of x / y coordinates in km.
+    """
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    mid_latitude = np.radians(np.nanmean(latitude)) if len(latitude) else 0
+
+    return np.column_stack([longitude * 111.32 * np.cos(mid_latitude), latitude * 110.57])
+
+
+def build_sales_index(
+    sales: pd.DataFrame,
+    price_col: str = 'interpolated_price',
+) -> Tuple[cKDTree, np.ndarray, pd.Index]:
+    """Build the spatial index over a single years worth of sales.
+
+    Parameters
+    ----------
+    sales : Sales in one year, with 'x_km', 'y_km' and 'property_id' columns, one row per property.
+    price_col : Name of the price column.
+
+    Returns
+    -------
+    Tuple[cKDTree, np.ndarray, pd.Index]
+        The tree, the sale prices in tree order and the property IDs in tree order (for spotting self matches).
+    """
+    return (cKDTree(sales[['x_km', 'y_km']].values),
+            sales[price_col].values.astype(float),
+            pd.Index(sales['property_id'].values))
+
+
+def masked_row_stat(
+    stat: Callable[..., np.ndarray],
+    values: np.ndarray,
+    mask: np.ndarray,
+) -> np.ndarray:
+    """Apply a nan aware stat across each row of values, only counting the elements where mask is True.
+
+    Parameters
+    ----------
+    stat : Nan aware numpy function taking an axis argument, i.e. np.nanmedian.
+    values : 2D array of values.
+    mask : Boolean array the same shape as values.
+
+    Returns
+    -------
+    np.ndarray
+        Stat per row, NaN for rows with nothing in the mask (without numpy moaning about all NaN slices).
+    """
+    result = np.full(len(values), np.nan)
+    rows = mask.any(axis=1)
+    result[rows] = stat(np.where(mask[rows], values[rows], np.nan), axis=1)
+
+    return result
+
+
+def query_neighbour_prices(
+    sales_index: Tuple[cKDTree, np.ndarray, pd.Index],
+    points: np.ndarray,
+    property_ids: np.ndarray,
+    k: int,
+    radius_km: float,
+    max_in_radius: int,
+    batch_size: int,
+) -> Dict[str, np.ndarray]:
+    """Get stats on the prices of sales near to each point, leaving out the points own sale if it has one.
+
+    Notes
+    -----
+    Everything goes through a single k nearest query per batch, asking for enough neighbours to cover both the k
+    nearest and anything within the radius (up to max_in_radius of them), so the median within the radius is over at
+    most the max_in_radius closest sales. The count within the radius is exact though.
+
+    Parameters
+    ----------
+    sales_index : Output of build_sales_index for the year of sales to compare against.
+    points : Array of shape (n, 2) of x / y coordinates in km to find neighbours for.
+    property_ids : Property ID of each point, so it doesn't count itself as a neighbour.
+    k : Number of nearest sales to take the stats over.
+    radius_km : Radius to count / take the median price of sales within.
+    max_in_radius : Cap on the number of sales used for the median within the radius.
+    batch_size : Number of points to query at once, to keep the (n, k) arrays a sensible size.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Arrays of 'knn_median_price', 'knn_mean_distance_km', 'radius_sale_count' and 'radius_median_price'.
+    """
+    tree, prices, sale_ids = sales_index
+    n_neighbours = min(max(k, max_in_radius) + 1, len(prices))  # + 1 as we might find ourselves
+    self_index = sale_ids.get_indexer(property_ids)
+
+    results = {name: np.full(len(points), np.nan) for name in ['knn_median_price', 'knn_mean_distance_km',
+                                                               'radius_sale_count', 'radius_median_price']}
+    if n_neighbours == 0:
+        results['radius_sale_count'][:] = 0
+        return results
+
+    for start in range(0, len(points), batch_size):
+        batch = slice(start, start + batch_size)
+        distances, neighbours = tree.query(points[batch], k=n_neighbours)
+        distances, neighbours = distances.reshape(len(neighbours), -1), neighbours.reshape(len(neighbours), -1)
+
+        is_neighbour = neighbours != self_index[batch, None]
+        neighbour_rank = np.cumsum(is_neighbour, axis=1)  # 1 for the nearest non self sale, 2 for the next etc...
+        neighbour_prices = prices[neighbours]
+
+        in_knn = is_neighbour & (neighbour_rank <= k)
+        results['knn_median_price'][batch] = masked_row_stat(np.nanmedian, neighbour_prices, in_knn)
+        results['knn_mean_distance_km'][batch] = masked_row_stat(np.nanmean, distances, in_knn)
+
+        in_radius = is_neighbour & (neighbour_rank <= max_in_radius) & (distances <= radius_km)
+        results['radius_median_price'][batch] = masked_row_stat(np.nanmedian, neighbour_prices, in_radius)
+
+        own_sale_in_radius = self_index[batch] >= 0  # a property is always within the radius of itself
+        results['radius_sale_count'][batch] = (tree.query_ball_point(points[batch], radius_km, return_length=True)
+                                               - own_sale_in_radius)
+
+    return results
+
+
+def get_neighbour_price_features(
+    df: pd.DataFrame,
+    k: int = 10,
+    radius_km: float = 1.0,
+    max_in_radius: int = 50,
+    batch_size: int = 100_000,
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
+    """Add spatial lag features on the prices of nearby sales, in both the same and the previous year, for every
+    property year.
+
+    Notes
+    -----
+    Comparing every property against every sale is quadratic per year, so instead one KD tree is built per year over
+    that years sales, and then reused for both the same year lookups of that year and the previous year lookups of the
+    year after. Trees get built and queried in a thread per year, scipy lets go of the GIL while it does so we do
+    actually get to use the cores.
+
+    Parameters
+    ----------
+    df : Property data with a row per property per year, including 'year', 'property_id', 'latitude', 'longitude',
+        'interpolated_price' and 'true_price' columns.
+    k : Number of nearest sales to take the median price over.
+    radius_km : Radius to count / take the median price of sales within.
+    max_in_radius : Cap on the number of sales used for the median within the radius.
+    batch_size : Number of property years to query at once.
+    max_workers : Number of threads, defaults to what ThreadPoolExecutor thinks is best.
+
+    Returns
+    -------
+    pd.DataFrame
+        Input dataframe with 'neighbour_median_price', 'neighbour_mean_distance', 'sales_in_radius' and
+        'radius_median_price' columns added, each for '_same_year' and '_previous_year'.
+    """
+    located = df['latitude'].notnull() & df['longitude'].notnull()
+    points = project_to_km(df['latitude'], df['longitude'])
+    coords = pd.DataFrame({'x_km': points[:, 0], 'y_km': points[:, 1]}, index=df.index)
+
+    sales = pd.concat([df[['year', 'property_id', 'interpolated_price']], coords], axis=1)
+    sales = sales[located & df['true_price'].astype(bool)].drop_duplicates(subset=['year', 'property_id'])
+    sales_by_year = {year: year_sales for year, year_sales in sales.groupby('year')}
+    rows_by_year = {year: np.flatnonzero((df['year'] == year).values & located.values) for year in df['year'].unique()}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        indexes = dict(zip(sales_by_year, executor.map(build_sales_index, sales_by_year.values())))
+
+        def query_year(year: Any) -> Dict[str, Dict[str, np.ndarray]]:
+            rows = rows_by_year[year]
+            year_results = {}
+            for suffix, index_year in [('same_year', year), ('previous_year', year - 1)]:
+                if index_year in indexes:
+                    year_results[suffix] = query_neighbour_prices(indexes[index_year], points[rows],
+                                                                  df['property_id'].values[rows],
+                                                                  k, radius_km, max_in_radius, batch_size)
+            return year_results
+
+        all_results = dict(zip(rows_by_year, executor.map(query_year, rows_by_year)))
+
+    names = {'knn_median_price': 'neighbour_median_price',
+             'knn_mean_distance_km': 'neighbour_mean_distance',
+             'radius_sale_count': 'sales_in_radius',
+             'radius_median_price': 'radius_median_price'}
+    for suffix in ['same_year', 'previous_year']:
+        for name, column in names.items():
+            values = np.full(len(df), np.nan)
+            for year, year_results in all_results.items():
+                if suffix in year_results:
+                    values[rows_by_year[year]] = year_results[suffix][name]
+                elif name == 'radius_sale_count':
+                    values[rows_by_year[year]] = 0  # no sales at all that year, so certainly none nearby
+            df[f'{column}_{suffix}'] = values
+
+    return df
+
+
+def normalise_address_columns(
+    df: pd.DataFrame,
+    address_cols: Tuple[str, ...] = ('saon', 'paon', 'street', 'locality', 'town'),
+) -> pd.DataFrame:
+    """Normalise the address columns so that the same address written a few different ways gets the same property ID.
+
+    Notes
+    -----
+    There's only a fraction as many distinct addresses as there are rows, so all the string faff is done on the
+    unique values and mapped back onto the rows.
+    Postcodes aren't done here, they get normalised as they're read in (see read_prices / read_postcodes) so that the
+    location join matches on the clean versions.
+
+    Parameters
+    ----------
+    df : Input property data.
+    address_cols : Names of the free text address columns to normalise, any not in the data are skipped.
+
+    Returns
+    -------
+    pd.DataFrame
+        Input dataframe with the address columns normalised in place.
+    """
+    for col in [col for col in address_cols if col in df.columns]:
+        df[col] = normalise_column(df[col], normalise_address)
 
     return df
 
@@ -177,6 +525,11 @@ def get_supermarket_stats(df: pd.DataFrame) -> pd.DataFrame:
 def add_basic_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Add the raw columns needed to the data, set dtype where needed.
 
+    Notes
+    -----
+    The postcode level and building type columns used to be added here too, but they only depend on what's made here so
+    they're their own stages now and can run alongside the interpolation.
+
     Parameters
     ----------
     df : Input property data, received after merge.
@@ -187,18 +540,217 @@ def add_basic_columns(df: pd.DataFrame) -> pd.DataFrame:
         Data but with the basic columns added on. Can you tell I didn't know what the basic columns would be yet when I
         wrote this?
     """
+    df = normalise_address_columns(df)
     df[['postcode', 'paon', 'street']] = df[['postcode', 'paon', 'street']].fillna('')  # we hash these so need no null
     df = create_col_hash(df=df, cols_to_hash=(df.postcode + df.paon + df.street))
 
-    df['deed_date'] = pd.to_datetime(df['deed_date'], format='%Y-%m-%d')
     df['year'] = df['deed_date'].dt.to_period('Y')  # to join interpolated data on later
 
-    df = get_postcode_columns(df)
-    df = get_property_type(df)
+    return df.copy()  # consolidates the blocks now, as pandas doing it lazily on read isn't safe across threads
+
+
+def read_postcodes() -> pd.DataFrame:
+    """Read in the postcode data, with column names fit for humans and postcodes in the standard format.
+
+    Returns
+    -------
+    pd.DataFrame
+        Postcode data.
+    """
+    postcodes = clean_column_names(df=load_input('postcodes'))
+    postcodes['postcode'] = normalise_column(postcodes['postcode'], normalise_postcode)
+
+    return postcodes
+
+
+def read_prices() -> pd.DataFrame:
+    """Read in the price paid data, with postcodes in the standard format so they match up with the postcode data.
+
+    Returns
+    -------
+    pd.DataFrame
+        Price data.
+    """
+    prices = load_input('prices')
+    prices['postcode'] = normalise_column(prices['postcode'], normalise_postcode)
+
+    return prices
+
+
+def merge_postcodes(
+    prices: pd.DataFrame,
+    postcodes: pd.DataFrame,
+) -> pd.DataFrame:
+    """Join the location info for each postcode onto the sales.
+
+    Parameters
+    ----------
+    prices : Price data.
+    postcodes : Postcode data.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per sale with location info added.
+    """
+    return prices.merge(postcodes, on='postcode', how='left')
+
+
+def get_postcode_level_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Run get_postcode_columns on a copy of just the columns it needs, so it can run at the same time as other stages
+    reading the same dataframe.
+
+    Parameters
+    ----------
+    df : Data with the basic columns added.
+
+    Returns
+    -------
+    pd.DataFrame
+        Only the new postcode level columns, on the same index as the input.
+    """
+    return get_postcode_columns(df[['postcode', 'latitude', 'longitude']].copy()).drop(
+        ['postcode', 'latitude', 'longitude'], axis=1)
+
+
+def get_building_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Run get_property_type on a copy of just the columns it needs, same deal as get_postcode_level_columns.
+
+    Parameters
+    ----------
+    df : Data with the basic columns added.
+
+    Returns
+    -------
+    pd.DataFrame
+        Only the 'building_type' column, on the same index as the input.
+    """
+    return get_property_type(df[['paon', 'saon']].copy())[['building_type']]
+
+
+def get_grid_cell_column(
+    df: pd.DataFrame,
+    bounds_file: str = GRID_BOUNDS_FILE,
+) -> pd.DataFrame:
+    """Tag each row with its hierarchical grid cell, for the dashboard map to work out what's on screen with.
+
+    Notes
+    -----
+    The grid covers the bounds of the data, which get saved to bounds_file so the dashboard knows what the keys mean.
+
+    Parameters
+    ----------
+    df : Data with the basic columns added.
+    bounds_file : Json file to save the bounds of the grid to.
+
+    Returns
+    -------
+    pd.DataFrame
+        Only the 'grid_cell' column, on the same index as the input.
+    """
+    bounds = get_region_bounds(df['longitude'].to_numpy(float), df['latitude'].to_numpy(float))
+    with open(bounds_file + '.tmp', 'w') as f:
+        json.dump(bounds, f)
+    os.replace(bounds_file + '.tmp', bounds_file)
+
+    return get_grid_cells(df['longitude'], df['latitude'], bounds).to_frame('grid_cell')
+
+
+def get_true_years(df: pd.DataFrame) -> pd.DataFrame:
+    """Get the years each property actually sold in, to tell real prices from interpolated ones later.
+
+    Parameters
+    ----------
+    df : Data with the basic columns added.
+
+    Returns
+    -------
+    pd.DataFrame
+        'year', 'property_id' and 'true_price' (always True).
+    """
+    true_years = df[['year', 'property_id']].copy()
+    true_years['true_price'] = True
+
+    return true_years
+
+
+def get_property_rows(
+    df: pd.DataFrame,
+    postcode_columns: pd.DataFrame,
+    building_types: pd.DataFrame,
+    grid_cells: pd.DataFrame,
+) -> pd.DataFrame:
+    """Put the per sale columns back together and boil them down to a row per property, keeping its latest sale.
+
+    Parameters
+    ----------
+    df : Data with the basic columns added.
+    postcode_columns : Output of get_postcode_level_columns.
+    building_types : Output of get_building_types.
+    grid_cells : Output of get_grid_cell_column.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per property, without any of the per sale columns.
+    """
+    df = pd.concat([df, postcode_columns, building_types, grid_cells], axis=1)
+    df = df.drop(['price_paid', 'year', 'unique_id', 'deed_date'], axis=1)
+
+    return df.drop_duplicates(subset='property_id', keep='last')
+
+
+def build_property_panel(
+    properties: pd.DataFrame,
+    interpolated_yearly_value: pd.DataFrame,
+    true_years: pd.DataFrame,
+) -> pd.DataFrame:
+    """Expand the properties out to a row per property per year, with the interpolated price for each year and whether
+    it was a real sale.
+
+    Parameters
+    ----------
+    properties : Row per property.
+    interpolated_yearly_value : Output of interpolate_price_paid.
+    true_years : Output of get_true_years.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per property per year.
+    """
+    df = track_step('merge_interpolated_price', pd.merge, properties, interpolated_yearly_value,
+                    on=['property_id'], how='outer')
+    df = track_step('merge_true_price', pd.merge, df, true_years, on=['year', 'property_id'], how='left')
+    df['true_price'] = df['true_price'].fillna(False)
+
+    df['in_use'] = convert_column_to_boolean(df['in_use'], 'Yes')
+    df['new_build'] = convert_column_to_boolean(df['new_build'], 'Y')
 
     return df
 
 
+def write_properties(
+    df: pd.DataFrame,
+    path: str = 'data/monmouthshire_properties.csv',
+) -> str:
+    """Save the engineered data.
+
+    Parameters
+    ----------
+    df : Complete engineered dataframe.
+    path : Csv to write to.
+
+    Returns
+    -------
+    str
+        Path written to, which is handy for chaining the snapshot on after.
+    """
+    df.to_csv(path, index=False)
+
+    return path
+
+
 def generate_shape_info(df: pd.DataFrame) -> None:
     """Generate the shape info dataframe to be displayed in the dashboard
 
@@ -222,7 +774,48 @@ def generate_shape_info(df: pd.DataFrame) -> None:
     results.to_csv('data/metadata/variable_info.csv', index=False)
 
 
-def engineering_main() -> None:
+def get_engineering_stages() -> List[Stage]:
+    """Lay out the engineering pipeline as a graph of stages and what each one needs.
+
+    Notes
+    -----
+    Supermarket stats only depend on where a property is, so they're worked out on the row per property table rather
+    than after it's been expanded out to every year. That means they can run alongside the interpolation, and on a
+    fraction of the rows.
+
+    Returns
+    -------
+    List[Stage]
+        Stages of the pipeline.
+    """
+    return [
+        Stage('read_postcodes', read_postcodes),  # the first 'p'
+        Stage('read_prices', read_prices),  # the second 'p'
+        Stage('merge_postcodes', merge_postcodes, ('read_prices', 'read_postcodes')),
+        Stage('add_basic_columns', add_basic_columns, ('merge_postcodes',)),
+        Stage('get_postcode_columns', get_postcode_level_columns, ('add_basic_columns',)),
+        Stage('get_property_type', get_building_types, ('add_basic_columns',)),
+        Stage('interpolate_price_paid', interpolate_price_paid, ('add_basic_columns',)),
+        Stage('get_grid_cells', get_grid_cell_column, ('add_basic_columns',)),
+        Stage('get_true_years', get_true_years, ('add_basic_columns',)),
+        Stage('drop_duplicate_properties', get_property_rows,
+              ('add_basic_columns', 'get_postcode_columns', 'get_property_type', 'get_grid_cells')),
+        Stage('get_supermarket_stats', get_supermarket_stats, ('drop_duplicate_properties',)),
+        Stage('build_property_panel', build_property_panel,
+              ('get_supermarket_stats', 'interpolate_price_paid', 'get_true_years')),
+        Stage('get_neighbour_price_features', get_neighbour_price_features, ('build_property_panel',)),
+        Stage('write_properties', write_properties, ('get_neighbour_price_features',)),  # the third 'p'
+        Stage('write_properties_snapshot', write_properties_snapshot, ('write_properties',)),  # for the dashboards
+        Stage('generate_shape_info', generate_shape_info, ('get_neighbour_price_features',)),
+        Stage('build_price_tiles', build_price_tiles, ('get_neighbour_price_features',)),  # for the dashboard maps
+    ]
+
+
+def engineering_main(
+    instrument: bool = False,
+    executor: str = 'thread',
+    max_workers: Optional[int] = None,
+) -> pd.DataFrame:
     """Run the engineering pipeline end to end, saving output to csv (how do I typehint a csv output?).
 
     Notes
@@ -231,37 +824,33 @@ def engineering_main() -> None:
     seen what impact this might have on the analysis.
     P.S. I've no idea what the comments about the three p's are, chalk them up to heat stroke I guess it hit 30 degrees
     today.
-    """
-    postcodes = pd.read_csv('data/monmouthshire_postcodes.csv')  # the first 'p'
-    postcodes = clean_column_names(df=postcodes)
-
-    prices = pd.read_csv('data/monmouthshire_prices.csv')  # the second 'p'
-
-    full_df = prices.merge(postcodes, on='postcode', how='left')
-    full_df = add_basic_columns(full_df)
 
-    interpolated_yearly_value = interpolate_price_paid(full_df)
-
-    true_years = full_df[['year', 'property_id']]
-    true_years['true_price'] = True
-    full_df.drop(['price_paid', 'year', 'unique_id', 'deed_date'], inplace=True, axis=1)
-    full_df = full_df.drop_duplicates(subset='property_id', keep='last')
+    Parameters
+    ----------
+    instrument : Set True to record the time, memory and row counts of each stage to data/metadata. Stages running at
+        the same time share the one process, so their CPU time and peak RSS overlap.
+    executor : 'thread' or 'process', for what runs the independent stages concurrently. Only 'thread' can be
+        instrumented.
+    max_workers : Max number of stages to run at once, set to 1 to run them one after another like the old days.
 
-    full_df = full_df.merge(interpolated_yearly_value, on=['property_id'], how='outer')
-    full_df = full_df.merge(true_years, on=['year', 'property_id'], how='left')
-    full_df['true_price'] = full_df['true_price'].fillna(False)
+    Returns
+    -------
+    pd.DataFrame
+        When each stage ran and which were on the critical path.
+    """
+    metrics = PipelineMetrics(enabled=instrument)
 
-    full_df['in_use'] = convert_column_to_boolean(full_df['in_use'], 'Yes')
-    full_df['new_build'] = convert_column_to_boolean(full_df['new_build'], 'Y')
-    full_df['introduced'] = pd.to_datetime(full_df['introduced'], format='%Y-%m-%d')
-    full_df['last_updated'] = pd.to_datetime(full_df['last_updated'], format='%Y-%m-%d')
-    full_df['terminated'] = pd.to_datetime(full_df['terminated'], format='%Y-%m-%d')
+    _, schedule = run_dag(get_engineering_stages(), executor=executor, max_workers=max_workers, metrics=metrics)
 
-    full_df = get_supermarket_stats(full_df)
+    metrics.add_schedule(schedule)
+    metrics.save()
 
-    full_df.to_csv('data/monmouthshire_properties.csv', index=False)  # the third 'p'
-    generate_shape_info(full_df)
+    return schedule
 
 
 if __name__ == '__main__':
-    engineering_main()
+    schedule = engineering_main(instrument='--instrument' in sys.argv,
+                                executor='process' if '--processes' in sys.argv else 'thread')
+    critical_path = schedule[schedule['on_critical_path']]
+    print(f"critical path ({critical_path['duration_seconds'].sum():.1f}s of {schedule['end_seconds'].max():.1f}s): "
+          + ' -> '.join(critical_path['stage']))
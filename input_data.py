@@ -0,0 +1,189 @@
+"""
+Typed loading of the raw input csvs. Each file has a declared schema of the columns we actually use and their types
+(dates included), which gets handed to pyarrows multithreaded csv reader, so there's no more reading every column as
+whatever pandas fancies and then fixing the dates up afterwards.
+
+The parsed result is saved as an Arrow snapshot in data/snapshots, and reused on later runs until the source csv or
+the schema changes. The supermarket file is the full national list, so this saves re-parsing 17k rows every run just
+to keep the couple of hundred in Gwent and Powys.
+"""
+import os
+import json
+import hashlib
+from functools import reduce
+from typing import Dict, List, Optional, Any
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
+from data_manipulation import write_arrow_file
+
+SNAPSHOT_DIR = 'data/snapshots'
+
+INPUT_SCHEMAS = {
+    'prices': {
+        'path': 'data/monmouthshire_prices.csv',
+        'columns': {
+            'unique_id': pa.string(),
+            'price_paid': pa.int64(),
+            'deed_date': pa.timestamp('ns'),
+            'postcode': pa.string(),
+            'property_type': pa.string(),
+            'new_build': pa.string(),
+            'estate_type': pa.string(),
+            'saon': pa.string(),
+            'paon': pa.string(),
+            'street': pa.string(),
+            'locality': pa.string(),
+            'town': pa.string(),
+            'district': pa.string(),
+            'county': pa.string(),
+            'transaction_category': pa.string(),
+            'linked_data_uri': pa.string(),
+        },
+    },
+    'postcodes': {
+        'path': 'data/monmouthshire_postcodes.csv',
+        'columns': {
+            'Postcode': pa.string(),
+            'In Use?': pa.string(),
+            'Latitude': pa.float64(),
+            'Longitude': pa.float64(),
+            'Easting': pa.int64(),
+            'Northing': pa.int64(),
+            'Grid Ref': pa.string(),
+            'Ward': pa.string(),
+            'Parish': pa.string(),
+            'Introduced': pa.timestamp('ns'),
+            'Terminated': pa.timestamp('ns'),
+            'Altitude': pa.int64(),
+            'Country': pa.string(),
+            'Last Updated': pa.timestamp('ns'),
+            'Quality': pa.string(),
+            'LSOA Code': pa.string(),
+            'LSOA Name': pa.string(),
+        },
+    },
+    'supermarkets': {
+        'path': 'data/geolityx_supermarkets_locations.csv',
+        'columns': {
+            'id': pa.int64(),
+            'fascia': pa.string(),
+            'postcode': pa.string(),
+            'long_wgs': pa.float64(),
+            'lat_wgs': pa.float64(),
+            'county': pa.string(),
+        },
+    },
+}
+
+
+def get_source_signature(
+    path: str,
+    columns: Dict[str, pa.DataType],
+) -> str:
+    """Fingerprint a source csv and the schema it's read with, so we can tell when a snapshot has gone stale.
+
+    Parameters
+    ----------
+    path : Path of the source csv.
+    columns : Declared column types.
+
+    Returns
+    -------
+    str
+        Hash of the files size and modified time plus the schema.
+    """
+    stat = os.stat(path)
+    schema = {col: str(dtype) for col, dtype in columns.items()}
+    signature = json.dumps([stat.st_size, stat.st_mtime_ns, schema])
+
+    return hashlib.md5(signature.encode('utf-8')).hexdigest()
+
+
+def read_csv_with_schema(
+    path: str,
+    columns: Dict[str, pa.DataType],
+) -> pa.Table:
+    """Read only the declared columns of a csv, parsed straight to the declared types on multiple threads.
+
+    Notes
+    -----
+    Empty strings are read in as nulls for every type, same as pandas does, otherwise the null checks further down
+    the pipeline would stop spotting empty address fields.
+
+    Parameters
+    ----------
+    path : Path of the csv.
+    columns : Declared column types.
+
+    Returns
+    -------
+    pa.Table
+        Table of the declared columns.
+    """
+    return pv.read_csv(path,
+                       read_options=pv.ReadOptions(use_threads=True),
+                       convert_options=pv.ConvertOptions(column_types=columns,
+                                                         include_columns=list(columns),
+                                                         strings_can_be_null=True))
+
+
+def load_input_table(name: str) -> pa.Table:
+    """Get the typed table for one of the input files, from its snapshot if that's still fresh, otherwise from the csv
+    (refreshing the snapshot as we go).
+
+    Parameters
+    ----------
+    name : Name of the input, one of the keys of INPUT_SCHEMAS.
+
+    Returns
+    -------
+    pa.Table
+        Typed table of the declared columns.
+    """
+    schema = INPUT_SCHEMAS[name]
+    signature = get_source_signature(schema['path'], schema['columns'])
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f'{name}.arrow')
+
+    if os.path.exists(snapshot_path):
+        table = pa.ipc.open_file(pa.memory_map(snapshot_path, 'r')).read_all()
+        if (table.schema.metadata or {}).get(b'source_signature') == signature.encode('utf-8'):
+            return table
+
+    table = read_csv_with_schema(schema['path'], schema['columns'])
+    table = table.replace_schema_metadata({'source_signature': signature})
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_arrow_file(table, snapshot_path)
+
+    return table
+
+
+def load_input(
+    name: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[Dict[str, List[Any]]] = None,
+) -> pd.DataFrame:
+    """Load one of the raw input files as a typed dataframe.
+
+    Parameters
+    ----------
+    name : Name of the input, one of the keys of INPUT_SCHEMAS.
+    columns : Subset of the declared columns to return, or None for all of them.
+    filters : Dictionary of column name to the values to keep, applied before anything is turned into pandas.
+
+    Returns
+    -------
+    pd.DataFrame
+        The requested data, with dates already parsed.
+    """
+    table = load_input_table(name)
+
+    if filters:
+        mask = reduce(pc.and_, [pc.is_in(table[col], value_set=pa.array(values, type=table.schema.field(col).type))
+                                for col, values in filters.items()])
+        table = table.filter(pc.fill_null(mask, False))
+    if columns is not None:
+        table = table.select(columns)
+
+    return table.to_pandas()
@@ -0,0 +1,482 @@
+"""
+Load testing for the dashboards, to find out how many analysts can poke at them at once before the callbacks start to
+crawl. Each dashboard gets started up for real in its own process on a local port, then a crowd of simulated clients
+replay a session of UI events (ticking towns, dragging the year slider, picking from dropdowns etc...) against it over
+HTTP, firing the same callback requests the browser would.
+
+The clients work out which requests to make from the apps own /_dash-dependencies, so an event fires every server side
+callback that has it as an input, with the current value of every other input / state that client has. Clientside
+callbacks are skipped as they never touch the server, and background job callbacks are polled until their interval is
+switched off again, same as the dcc.Interval would in the browser.
+
+Sessions are lists of events, each either {'id': ..., 'property': ..., 'value': ...} for a UI change or {'get': path}
+for a plain request (i.e. the clientside data endpoint), so a recorded session can be saved as json and replayed in
+place of the default ones.
+
+Run as a script to test at the default numbers of clients, or i.e. 'python load_test.py 1 10 50' for specific ones.
+Results are saved as a csv in data/benchmarks.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Optional
+import numpy as np
+import pandas as pd
+from benchmark import synthetic_workdir, REPO_DIR, RESULTS_DIR
+from engineer_data import engineering_main
+
+DEFAULT_CLIENT_COUNTS = [1, 5, 10, 25]
+DEFAULT_ROWS = 100_000
+
+SESSIONS = {
+    'analysis_dashboard': [
+        {'get': '/data/properties.arrow'},
+        {'id': 'properties_to_plot', 'property': 'value', 'value': ['ABERGAVENNY', 'USK']},
+        {'id': 'date_range_for_price_data', 'property': 'value', 'value': [2005, 2020]},
+        {'id': 'variables_dropdown', 'property': 'value', 'value': 'supermarkets_in_area'},
+        {'id': 'variables_dropdown_2', 'property': 'value', 'value': 'town'},
+        {'id': 'properties_to_plot', 'property': 'value', 'value': ['ABERGAVENNY', 'USK', 'MONMOUTH', 'CHEPSTOW']},
+        {'id': 'price_surface_year', 'property': 'value', 'value': 2010},
+        {'id': 'price_surface', 'property': 'relayoutData',
+         'value': {'xaxis.range[0]': -3.05, 'xaxis.range[1]': -2.98, 'yaxis.range[0]': 51.80, 'yaxis.range[1]': 51.85}},
+        {'id': 'date_range_for_price_data', 'property': 'value', 'value': [1995, 2021]},
+    ],
+    'validation_dashboard': [
+        {'id': 'choose_file', 'property': 'value', 'value': 'monmouthshire_prices'},
+        {'id': 'sort_by', 'property': 'value', 'value': ['NULLs']},
+        {'id': 'choose_file', 'property': 'value', 'value': 'Complete'},
+        {'id': 'pipeline_metric', 'property': 'value', 'value': 'peak_rss_mb'},
+        {'id': 'choose_file', 'property': 'value', 'value': 'constructed by Johnno'},
+        {'id': 'sort_by', 'property': 'value', 'value': ['Source File', 'Uniques']},
+    ],
+}
+
+
+def get_free_port() -> int:
+    """Ask the OS for a port nobody is using.
+
+    Returns
+    -------
+    int
+        Free port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(
+    module_name: str,
+    port: int,
+    timeout: float = 60.0,
+) -> subprocess.Popen:
+    """Start a dashboard in its own process, the same way as running the module would, and wait until it's answering.
+
+    Parameters
+    ----------
+    module_name : Name of the dashboard module, i.e. 'analysis_dashboard'.
+    port : Port to serve on.
+    timeout : Seconds to wait for the server to come up.
+
+    Returns
+    -------
+    subprocess.Popen
+        The server process, which is on the caller to terminate.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', '-c',
+                                f'import {module_name}; {module_name}.app.run_server(port={port}, threaded=True)'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{module_name} exited with code {process.returncode} on start up')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/_dash-layout', timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f'{module_name} did not start within {timeout}s')
+
+
+def get_json(url: str) -> Any:
+    """GET some json.
+
+    Parameters
+    ----------
+    url : Address to fetch.
+
+    Returns
+    -------
+    Any
+        Decoded response.
+    """
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def parse_outputs(output: str) -> List[Tuple[str, str]]:
+    """Split a dash output string, i.e. 'fig.figure' or '..fig.figure...status.children..', into (id, property) pairs.
+
+    Parameters
+    ----------
+    output : Output string from /_dash-dependencies.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        ID and property of each output.
+    """
+    outputs = output[2:-2].split('...') if output.startswith('..') else [output]
+
+    return [tuple(item.rsplit('.', 1)) for item in outputs]
+
+
+def collect_props(
+    layout: Any,
+    props: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Walk the layout from /_dash-layout picking out the starting props of every component with an ID.
+
+    Parameters
+    ----------
+    layout : Layout, or a bit of one.
+    props : Dictionary being filled in, used on the way down.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Component ID to its props, along with the component type under '_type'.
+    """
+    props = {} if props is None else props
+    if isinstance(layout, list):
+        for child in layout:
+            collect_props(child, props)
+    elif isinstance(layout, dict) and 'props' in layout:
+        if 'id' in layout['props']:
+            props[layout['props']['id']] = dict(layout['props'], _type=layout['type'])
+        collect_props(layout['props'].get('children'), props)
+
+    return props
+
+
+class DashClient:
+    """One simulated analyst, keeping track of what their page currently shows and firing callbacks like the browser.
+
+    Parameters
+    ----------
+    base_url : Address of the dashboard, i.e. 'http://127.0.0.1:8050'.
+    dependencies : Callbacks from /_dash-dependencies.
+    layout_props : Starting props of each component, from collect_props.
+    poll_timeout : Max seconds to keep polling a background job for.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        dependencies: List[Dict[str, Any]],
+        layout_props: Dict[str, Dict[str, Any]],
+        poll_timeout: float = 120.0,
+    ):
+        self.base_url = base_url
+        self.callbacks = [dep for dep in dependencies if dep.get('clientside_function') is None]
+        self.props = {component_id: dict(props) for component_id, props in layout_props.items()}
+        self.poll_timeout = poll_timeout
+        self.timings: List[Dict[str, Any]] = []
+
+    def _record(self, name: str, seconds: float, ok: bool) -> None:
+        self.timings.append({'callback': name, 'start': time.time() - seconds, 'seconds': seconds, 'ok': ok})
+
+    def get(self, path: str) -> None:
+        """Make a plain GET request, timing it.
+
+        Parameters
+        ----------
+        path : Path to fetch.
+        """
+        start, ok = time.perf_counter(), True
+        try:
+            with urllib.request.urlopen(self.base_url + path) as response:
+                response.read()
+        except (urllib.error.URLError, ConnectionError):
+            ok = False
+        self._record(f'GET {path}', time.perf_counter() - start, ok)
+
+    def fire(
+        self,
+        callback: Dict[str, Any],
+        changed: List[str],
+    ) -> None:
+        """Send a callback request with this clients current values, and apply whatever comes back.
+
+        Parameters
+        ----------
+        callback : The callback, from /_dash-dependencies.
+        changed : 'id.property' of the inputs that triggered it.
+        """
+        outputs = [{'id': component_id, 'property': prop} for component_id, prop in parse_outputs(callback['output'])]
+        payload = {'output': callback['output'],
+                   'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+                   'inputs': [dict(item, value=self.props.get(item['id'], {}).get(item['property']))
+                              for item in callback['inputs']],
+                   'changedPropIds': changed,
+                   'state': [dict(item, value=self.props.get(item['id'], {}).get(item['property']))
+                             for item in callback['state']]}
+        request = urllib.request.Request(self.base_url + '/_dash-update-component',
+                                         data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+
+        start, ok, body = time.perf_counter(), True, b''
+        try:
+            with urllib.request.urlopen(request) as response:
+                body = response.read()  # 204 means PreventUpdate, so nothing to apply
+        except (urllib.error.URLError, ConnectionError):
+            ok = False
+        self._record(outputs[0]['id'] + '.' + outputs[0]['property'], time.perf_counter() - start, ok)
+
+        if body:
+            for component_id, new_props in json.loads(body).get('response', {}).items():
+                self.props.setdefault(component_id, {}).update(new_props)
+
+    def trigger(
+        self,
+        component_id: str,
+        prop: str,
+        value: Any,
+    ) -> None:
+        """Change a components prop, as if the user had, firing every server callback that takes it as an input.
+
+        Parameters
+        ----------
+        component_id : ID of the component.
+        prop : Property being changed.
+        value : New value.
+        """
+        self.props.setdefault(component_id, {})[prop] = value
+        for callback in self.callbacks:
+            if {'id': component_id, 'property': prop} in callback['inputs']:
+                self.fire(callback, [f'{component_id}.{prop}'])
+
+    def active_polls(self) -> List[str]:
+        """Find the switched on dcc.Intervals which feed a server callback, i.e. background jobs still being waited on.
+
+        Returns
+        -------
+        List[str]
+            IDs of the intervals.
+        """
+        inputs = {item['id'] for callback in self.callbacks for item in callback['inputs']}
+
+        return [component_id for component_id, props in self.props.items()
+                if props.get('_type') == 'Interval' and not props.get('disabled', False) and component_id in inputs]
+
+    def settle(self) -> None:
+        """Keep firing any active polling intervals at their interval until they've all been switched off."""
+        deadline = time.time() + self.poll_timeout
+        polls = self.active_polls()
+        while polls and time.time() < deadline:
+            time.sleep(min(self.props[component_id].get('interval', 1000) for component_id in polls) / 1000)
+            for component_id in polls:
+                self.trigger(component_id, 'n_intervals', (self.props[component_id].get('n_intervals') or 0) + 1)
+            polls = self.active_polls()
+
+    def load_page(self) -> None:
+        """Fire every server callback once, like the browser does when the page first loads."""
+        start = time.perf_counter()
+        for callback in self.callbacks:
+            if not callback.get('prevent_initial_call'):
+                self.fire(callback, [])
+        self.settle()
+        self._record('page load (settled)', time.perf_counter() - start, True)
+
+    def run_session(
+        self,
+        session: List[Dict[str, Any]],
+        think_time: float,
+        rng: random.Random,
+    ) -> None:
+        """Replay a session of events, waiting for each to settle (background jobs included) before the next.
+
+        Parameters
+        ----------
+        session : Events to replay.
+        think_time : Mean seconds to wait between events, jittered so the clients don't all move in lockstep.
+        rng : Random state for the jitter.
+        """
+        for event in session:
+            time.sleep(rng.uniform(0, 2 * think_time))
+            if 'get' in event:
+                self.get(event['get'])
+                continue
+
+            start = time.perf_counter()
+            self.trigger(event['id'], event['property'], event['value'])
+            self.settle()
+            self._record(f"{event['id']}.{event['property']} (settled)", time.perf_counter() - start, True)
+
+
+def run_clients(
+    base_url: str,
+    session: List[Dict[str, Any]],
+    n_clients: int,
+    repeats: int = 1,
+    think_time: float = 0.5,
+    seed: int = 0,
+) -> Tuple[pd.DataFrame, float]:
+    """Set a crowd of clients loose on a running dashboard, each loading the page and then replaying the session.
+
+    Parameters
+    ----------
+    base_url : Address of the dashboard.
+    session : Events for each client to replay.
+    n_clients : Number of clients at once.
+    repeats : Times each client replays the session.
+    think_time : Mean seconds between each clients events.
+    seed : Random seed for the jitter.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, float]
+        Every request made with how long it took, and the wall time of the whole run.
+    """
+    dependencies = get_json(base_url + '/_dash-dependencies')
+    layout_props = collect_props(get_json(base_url + '/_dash-layout'))
+
+    def run_client(client_no: int) -> List[Dict[str, Any]]:
+        rng = random.Random(seed + client_no)
+        client = DashClient(base_url, dependencies, layout_props)
+        time.sleep(rng.uniform(0, think_time))  # stagger the arrivals
+        client.load_page()
+        for _ in range(repeats):
+            client.run_session(session, think_time, rng)
+        return client.timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as pool:
+        timings = [timing for client_timings in pool.map(run_client, range(n_clients)) for timing in client_timings]
+
+    return pd.DataFrame(timings), time.perf_counter() - start
+
+
+def summarise_timings(
+    timings: pd.DataFrame,
+    duration: float,
+) -> pd.DataFrame:
+    """Boil the timings of a run down to latency percentiles and throughput per callback.
+
+    Parameters
+    ----------
+    timings : Output of run_clients.
+    duration : Wall time of the run in seconds.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per callback with the number of requests and errors, p50 / p95 / p99 latency in ms and requests per second.
+    """
+    rows = []
+    for name, group in timings.groupby('callback'):
+        latency_ms = group['seconds'].to_numpy() * 1000
+        rows.append({'callback': name,
+                     'requests': len(group),
+                     'errors': int((~group['ok']).sum()),
+                     'p50_ms': round(float(np.percentile(latency_ms, 50)), 1),
+                     'p95_ms': round(float(np.percentile(latency_ms, 95)), 1),
+                     'p99_ms': round(float(np.percentile(latency_ms, 99)), 1),
+                     'throughput_rps': round(len(group) / duration, 2)})
+
+    return pd.DataFrame(rows)
+
+
+def load_test_app(
+    module_name: str,
+    client_counts: List[int],
+    session: Optional[List[Dict[str, Any]]] = None,
+    repeats: int = 1,
+    think_time: float = 0.5,
+) -> pd.DataFrame:
+    """Start a dashboard and load test it at increasing numbers of clients. Needs running from within a folder with the
+    engineered data in, i.e. the repo or a synthetic_workdir.
+
+    Parameters
+    ----------
+    module_name : Name of the dashboard module.
+    client_counts : Numbers of clients to test with, each run on a freshly started server.
+    session : Events for each client to replay, defaults to the one in SESSIONS for the app.
+    repeats : Times each client replays the session.
+    think_time : Mean seconds between each clients events.
+
+    Returns
+    -------
+    pd.DataFrame
+        Output of summarise_timings for each client count, with 'app' and 'clients' columns added.
+    """
+    session = SESSIONS[module_name] if session is None else session
+
+    summaries = []
+    for n_clients in client_counts:
+        port = get_free_port()
+        process = start_app(module_name, port)
+        try:
+            timings, duration = run_clients(f'http://127.0.0.1:{port}', session, n_clients, repeats, think_time)
+        finally:
+            process.terminate()
+            process.wait()
+
+        summary = summarise_timings(timings, duration)
+        summary.insert(0, 'clients', n_clients)
+        summary.insert(0, 'app', module_name)
+        summaries.append(summary)
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+def load_test_main(
+    client_counts: Optional[List[int]] = None,
+    n_rows: int = DEFAULT_ROWS,
+    session_files: Optional[Dict[str, str]] = None,
+) -> str:
+    """Build a set of synthetic engineered data, load test both dashboards against it and save the results.
+
+    Parameters
+    ----------
+    client_counts : Numbers of clients to test with, defaults to DEFAULT_CLIENT_COUNTS.
+    n_rows : Rows of synthetic price data to engineer.
+    session_files : Dashboard module name to a json file of recorded events to replay instead of the default session.
+
+    Returns
+    -------
+    str
+        Path to the saved results.
+    """
+    client_counts = DEFAULT_CLIENT_COUNTS if client_counts is None else client_counts
+    sessions = {}
+    for module_name, path in (session_files or {}).items():
+        with open(path) as f:
+            sessions[module_name] = json.load(f)
+
+    with synthetic_workdir(n_rows):
+        engineering_main()
+        results = pd.concat([load_test_app(module_name, client_counts, sessions.get(module_name))
+                             for module_name in SESSIONS], ignore_index=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    results.to_csv(path, index=False)
+
+    return path
+
+
+if __name__ == '__main__':
+    print(load_test_main([int(count) for count in sys.argv[1:]] or None))
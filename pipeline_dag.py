@@ -0,0 +1,194 @@
+"""
+Tiny dependency graph scheduler for the engineering pipeline. Each stage names the stages whose outputs it takes as
+inputs, and gets kicked off as soon as they've all finished, so independent stages (i.e. interpolation vs supermarket
+proximity) run at the same time rather than politely waiting their turn.
+
+Threads by default, which suits stages that spend their time in numpy / scipy / the csv reader with the GIL let go.
+Processes are there for the pure python heavy stages, at the cost of pickling every input and output across.
+
+Once it's done it works out the critical path, i.e. the chain of stages that actually decided how long the whole thing
+took, as that's the only place speeding anything up will make a difference.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Any, Dict, List, NamedTuple, Tuple, Optional
+import pandas as pd
+from pipeline_metrics import PipelineMetrics
+
+
+class Stage(NamedTuple):
+    """A single step of the pipeline.
+
+    Parameters
+    ----------
+    name : Unique name of the stage, which later stages use to ask for its output.
+    func : Function to run, called with the outputs of the input stages as positional args in order.
+    inputs : Names of the stages whose outputs this one needs.
+    """
+    name: str
+    func: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+
+
+def check_stages(stages: List[Stage]) -> None:
+    """Make sure the stages actually form a DAG, i.e. names are unique, inputs exist and there are no cycles.
+
+    Parameters
+    ----------
+    stages : Stages of the pipeline.
+    """
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f'duplicate stage names in {names}')
+
+    for stage in stages:
+        missing = set(stage.inputs) - set(names)
+        if missing:
+            raise ValueError(f'stage {stage.name!r} needs unknown stages {sorted(missing)}')
+
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage.inputs) <= done]
+        if not ready:
+            raise ValueError(f'cycle between stages {sorted(stage.name for stage in remaining)}')
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def run_stage(
+    func: Callable[..., Any],
+    args: Tuple[Any, ...],
+) -> Tuple[Any, float, float]:
+    """Run a stage, noting when it started and finished. Module level so it can be pickled over to worker processes.
+
+    Parameters
+    ----------
+    func : Stage function.
+    args : Args to call it with.
+
+    Returns
+    -------
+    Tuple[Any, float, float]
+        Output of the stage, start time and end time (as epoch seconds, so they line up across processes).
+    """
+    start = time.time()
+    output = func(*args)
+
+    return output, start, time.time()
+
+
+def find_critical_path(
+    stages: List[Stage],
+    durations: Dict[str, float],
+) -> List[str]:
+    """Find the chain of dependent stages with the longest total duration, which sets the minimum possible wall time
+    no matter how many workers there are.
+
+    Parameters
+    ----------
+    stages : Stages of the pipeline, in any order.
+    durations : Seconds taken by each stage.
+
+    Returns
+    -------
+    List[str]
+        Names of the stages on the critical path, in the order they ran.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    finish, previous = {}, {}
+
+    def longest_to(name: str) -> float:
+        if name not in finish:
+            inputs = by_name[name].inputs
+            previous[name] = max(inputs, key=longest_to) if inputs else None
+            finish[name] = durations[name] + (longest_to(previous[name]) if inputs else 0.0)
+        return finish[name]
+
+    name = max(by_name, key=longest_to)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+
+    return path[::-1]
+
+
+def run_dag(
+    stages: List[Stage],
+    executor: str = 'thread',
+    max_workers: Optional[int] = None,
+    metrics: Optional[PipelineMetrics] = None,
+) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    """Run the stages of a pipeline, each as soon as its inputs are ready.
+
+    Notes
+    -----
+    Outputs are dropped as soon as nothing else needs them so that the intermediate dataframes don't all hang about
+    until the end. The stages with no dependents are the ones that get handed back.
+
+    Parameters
+    ----------
+    stages : Stages of the pipeline.
+    executor : 'thread' or 'process'.
+    max_workers : Max number of stages to run at once, defaults to whatever the executor thinks.
+    metrics : Metrics tracker to record each stage with. Only works with threads, as the records would be stuck in the
+        worker processes otherwise, so an enabled tracker with executor='process' is a ValueError.
+
+    Returns
+    -------
+    Tuple[Dict[str, Any], pd.DataFrame]
+        Outputs of the final stages by name, and a schedule with the start / end offsets and duration in seconds of
+        each stage and whether it was on the critical path.
+    """
+    check_stages(stages)
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}")
+    if executor == 'process' and metrics is not None and metrics.enabled:
+        raise ValueError("metrics can't be recorded with the 'process' executor, use 'thread' to instrument a run")
+
+    by_name = {stage.name: stage for stage in stages}
+    dependents = {stage.name: [other.name for other in stages if stage.name in other.inputs] for stage in stages}
+    waiting_on = {stage.name: set(stage.inputs) for stage in stages}
+    outputs, timings, running = {}, {}, {}
+
+    pool = ThreadPoolExecutor(max_workers) if executor == 'thread' else ProcessPoolExecutor(max_workers)
+    with pool:
+        def submit(name: str) -> None:
+            stage = by_name[name]
+            args = tuple(outputs[input_name] for input_name in stage.inputs)
+            if metrics is not None and executor == 'thread':
+                running[pool.submit(run_stage, metrics.track, (name, stage.func) + args)] = name
+            else:
+                running[pool.submit(run_stage, stage.func, args)] = name
+
+        for name in [name for name, inputs in waiting_on.items() if not inputs]:
+            submit(name)
+
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                outputs[name], start, end = future.result()
+                timings[name] = (start, end)
+
+                for dependent in dependents[name]:
+                    waiting_on[dependent].discard(name)
+                    if not waiting_on[dependent]:
+                        submit(dependent)
+
+                for input_name in by_name[name].inputs:  # let go of anything nobody else is waiting on
+                    if all(dependent in timings for dependent in dependents[input_name]):
+                        outputs.pop(input_name, None)
+
+    durations = {name: end - start for name, (start, end) in timings.items()}
+    critical_path = find_critical_path(stages, durations)
+    first_start = min(start for start, _ in timings.values())
+    schedule = pd.DataFrame([{'stage': name,
+                              'start_seconds': round(start - first_start, 4),
+                              'end_seconds': round(end - first_start, 4),
+                              'duration_seconds': round(end - start, 4),
+                              'on_critical_path': name in critical_path}
+                             for name, (start, end) in timings.items()]).sort_values('start_seconds')
+
+    return {name: output for name, output in outputs.items() if not dependents[name]}, schedule
@@ -0,0 +1,201 @@
+"""
+Opt in timing and memory tracking for the stages of the engineering pipeline, so we can see which bits are slow or
+memory hungry without having to break out a profiler. Each run gets appended to data/metadata/pipeline_metrics.csv
+which the validation dashboard then charts across runs.
+
+When switched off the tracker just calls straight through to the stage so it costs nothing.
+
+Steps within a stage (i.e. the individual merges) can be tracked with track_step, which records them against whichever
+stage is running on the current thread, under that stage as their parent. Outside of a tracked stage it just calls
+straight through.
+"""
+import os
+import time
+import threading
+import contextvars
+from datetime import datetime
+from typing import Callable, Any, List, Dict, Optional
+import pandas as pd
+import psutil
+
+METRICS_FILE = 'data/metadata/pipeline_metrics.csv'
+
+_CURRENT_STAGE = contextvars.ContextVar('current_stage', default=None)  # (tracker, stage name) while a stage runs
+
+
+class PeakMemorySampler:
+    """Polls the resident memory of this process in a background thread, keeping hold of the highest value seen.
+
+    Notes
+    -----
+    The OS only keeps the peak RSS for the lifetime of the whole process, which is no use for telling stages apart, so
+    we have to sample it ourselves. Anything which spikes and drops again in under one interval could get missed.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self) -> 'PeakMemorySampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def count_rows(*objects: Any) -> int:
+    """Total up the rows of any dataframes or series within the input objects, ignoring everything else.
+
+    Parameters
+    ----------
+    objects : Objects that might be dataframes.
+
+    Returns
+    -------
+    int
+        Total number of rows.
+    """
+    return sum(len(obj) for obj in objects if isinstance(obj, (pd.DataFrame, pd.Series)))
+
+
+class PipelineMetrics:
+    """Records wall time, CPU time, peak RSS and rows in / out for each stage of a pipeline run.
+
+    Parameters
+    ----------
+    enabled : Set False to have track just call the stage with no recording.
+    run_id : Label for this run, defaults to the current time.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        run_id: Optional[str] = None,
+    ):
+        self.enabled = enabled
+        self.run_id = run_id or datetime.now().isoformat(timespec='seconds')
+        self.records: List[Dict[str, Any]] = []
+
+    def track(
+        self,
+        stage: str,
+        func: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Run a stage of the pipeline, recording how long it took and how much memory it used.
+
+        Notes
+        -----
+        Rows in is the total rows of every dataframe passed in, including the one a method is bound to, so for
+        'left.merge(right)' its the rows of both sides.
+        Steps tracked from inside the stage via track_step are recorded with this stage as their 'parent_stage', and
+        their time is included in this stages too.
+
+        Parameters
+        ----------
+        stage : Name to record the stage under.
+        func : Stage function to call.
+        args : Positional args for func.
+        kwargs : Keyword args for func.
+
+        Returns
+        -------
+        Any
+            Whatever func returns.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        rows_in = count_rows(getattr(func, '__self__', None), *args, *kwargs.values())
+        parent = _CURRENT_STAGE.get()
+        token = _CURRENT_STAGE.set((self, stage))
+        try:
+            with PeakMemorySampler() as sampler:
+                wall_start, cpu_start = time.perf_counter(), time.process_time()
+                output = func(*args, **kwargs)
+                wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        finally:
+            _CURRENT_STAGE.reset(token)
+
+        self.records.append({'run_id': self.run_id,
+                             'stage': stage,
+                             'parent_stage': parent[1] if parent is not None else None,
+                             'wall_seconds': round(wall_seconds, 4),
+                             'cpu_seconds': round(cpu_seconds, 4),
+                             'peak_rss_mb': round(sampler.peak / 1024 ** 2, 2),
+                             'rows_in': rows_in,
+                             'rows_out': count_rows(output)})
+
+        return output
+
+    def add_schedule(self, schedule: pd.DataFrame) -> None:
+        """Tag this runs records with when each stage started relative to the first, and whether it was on the critical
+        path, as reported by pipeline_dag.run_dag.
+
+        Parameters
+        ----------
+        schedule : Schedule returned by run_dag.
+        """
+        timings = schedule.set_index('stage')
+        for record in self.records:
+            if record['parent_stage'] is None and record['stage'] in timings.index:
+                record['start_seconds'] = timings.loc[record['stage'], 'start_seconds']
+                record['on_critical_path'] = bool(timings.loc[record['stage'], 'on_critical_path'])
+
+    def save(self, path: str = METRICS_FILE) -> None:
+        """Append this runs records to the metrics file, creating it if needs be.
+
+        Notes
+        -----
+        Older runs might not have every column (i.e. from before the pipeline ran as a DAG), so the file is rewritten
+        with the union of the columns rather than blindly appended to.
+
+        Parameters
+        ----------
+        path : Csv to append the records to.
+        """
+        if not self.enabled or not self.records:
+            return
+
+        records = pd.DataFrame(self.records)
+        if os.path.exists(path):
+            records = pd.concat([pd.read_csv(path), records], ignore_index=True)
+        records.to_csv(path, index=False)
+
+
+def track_step(
+    step: str,
+    func: Callable[..., Any],
+    *args: Any,
+    **kwargs: Any,
+) -> Any:
+    """Track a step within the stage currently running on this thread, if it's being tracked at all.
+
+    Parameters
+    ----------
+    step : Name to record the step under.
+    func : Step function to call.
+    args : Positional args for func.
+    kwargs : Keyword args for func.
+
+    Returns
+    -------
+    Any
+        Whatever func returns.
+    """
+    current = _CURRENT_STAGE.get()
+    if current is None:
+        return func(*args, **kwargs)
+
+    return current[0].track(step, func, *args, **kwargs)
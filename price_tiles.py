@@ -0,0 +1,327 @@
+"""
+Pre-rendered price surfaces for the dashboard maps. Prices get rasterised per year onto a grid over the region, which
+is built up into a pyramid of zoom levels (level 0 being the whole region as one tile, each level after splitting
+every tile into four) and saved as tiles in a numpy file per year, plus a small json index of where each tile lives.
+
+The dashboard then memory maps the files and only reads the tiles that cover whatever bit of the map is on screen, at
+a level of detail to match how far in it's zoomed, so nothing gets aggregated on the fly and zooming out over the
+whole county doesn't mean shipping every pixel of the finest level.
+
+Tiles with no sales in them aren't saved at all, which is most of them as the region is mostly fields and sheep.
+
+Right now the surface is just the mean interpolated price per pixel, but anything per property per year (i.e. model
+predictions, once we have a model) can be tiled the same way via value_col.
+"""
+import os
+import json
+from functools import lru_cache
+from typing import Dict, List, Tuple, Any, Optional
+import numpy as np
+import pandas as pd
+
+TILES_DIR = 'data/tiles'
+TILE_SIZE = 128  # pixels along each side of a tile
+MAX_LEVEL = 3  # finest level is TILE_SIZE * 2 ** MAX_LEVEL pixels across, ~50m a pixel over monmouthshire
+VIEWPORT_PIXELS = 256  # rough number of pixels we want across the map, to pick the level with
+
+
+def get_region_bounds(
+    longitude: np.ndarray,
+    latitude: np.ndarray,
+    padding: float = 0.01,
+) -> List[float]:
+    """Get the box to tile over, a touch bigger than the data so nothing sits right on the edge.
+
+    Parameters
+    ----------
+    longitude : Longitudes of the data.
+    latitude : Latitudes of the data.
+    padding : Fraction of the width / height to pad each side by.
+
+    Returns
+    -------
+    List[float]
+        [min longitude, min latitude, max longitude, max latitude].
+    """
+    min_lon, max_lon = np.nanmin(longitude), np.nanmax(longitude)
+    min_lat, max_lat = np.nanmin(latitude), np.nanmax(latitude)
+    pad_lon, pad_lat = (max_lon - min_lon) * padding or padding, (max_lat - min_lat) * padding or padding
+
+    return [float(min_lon - pad_lon), float(min_lat - pad_lat), float(max_lon + pad_lon), float(max_lat + pad_lat)]
+
+
+def rasterise(
+    longitude: np.ndarray,
+    latitude: np.ndarray,
+    values: np.ndarray,
+    bounds: List[float],
+    size: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Total up the values landing in each pixel of a size x size grid over the bounds.
+
+    Notes
+    -----
+    Rows run south to north and columns west to east, so row 0 is the bottom of the map.
+
+    Parameters
+    ----------
+    longitude : Longitude of each value.
+    latitude : Latitude of each value.
+    values : Values to rasterise, NaNs are skipped.
+    bounds : [min longitude, min latitude, max longitude, max latitude] of the grid.
+    size : Number of pixels along each side of the grid.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Sum and count of the values in each pixel.
+    """
+    keep = ~(np.isnan(longitude) | np.isnan(latitude) | np.isnan(values))
+    longitude, latitude, values = longitude[keep], latitude[keep], values[keep]
+
+    col = ((longitude - bounds[0]) / (bounds[2] - bounds[0]) * size).astype(int).clip(0, size - 1)
+    row = ((latitude - bounds[1]) / (bounds[3] - bounds[1]) * size).astype(int).clip(0, size - 1)
+    pixel = row * size + col
+
+    sums = np.bincount(pixel, weights=values, minlength=size * size).reshape(size, size)
+    counts = np.bincount(pixel, minlength=size * size).reshape(size, size)
+
+    return sums, counts
+
+
+def build_pyramid(
+    sums: np.ndarray,
+    counts: np.ndarray,
+    max_level: int,
+) -> List[np.ndarray]:
+    """Halve the resolution of the finest grid again and again to get every level of the pyramid.
+
+    Notes
+    -----
+    Sums and counts get added up over each 2 x 2 block rather than averaging the means, so a pixel with one sale in it
+    doesn't count as much as one with a hundred.
+
+    Parameters
+    ----------
+    sums : Sum of the values per pixel at the finest level.
+    counts : Count of the values per pixel at the finest level.
+    max_level : Level of the finest grid.
+
+    Returns
+    -------
+    List[np.ndarray]
+        Mean value per pixel at each level from 0 to max_level, NaN where there's no data.
+    """
+    levels = []
+    for _ in range(max_level + 1):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            levels.append((sums / counts).astype(np.float32))
+        size = sums.shape[0] // 2
+        sums = sums.reshape(size, 2, size, 2).sum(axis=(1, 3))
+        counts = counts.reshape(size, 2, size, 2).sum(axis=(1, 3))
+
+    return levels[::-1]
+
+
+def build_price_tiles(
+    df: pd.DataFrame,
+    value_col: str = 'interpolated_price',
+    tile_size: int = TILE_SIZE,
+    max_level: int = MAX_LEVEL,
+    tiles_dir: str = TILES_DIR,
+) -> Dict[str, Any]:
+    """Rasterise a price surface for each year into a pyramid of tiles, and save them along with their index.
+
+    Parameters
+    ----------
+    df : Property data with a row per property per year, including 'year', 'longitude', 'latitude' and value_col.
+    value_col : Column to make the surface out of.
+    tile_size : Pixels along each side of a tile.
+    max_level : Finest level of the pyramid.
+    tiles_dir : Folder to save the tiles to, each value_col gets its own subfolder.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The index, as saved to index.json.
+    """
+    out_dir = os.path.join(tiles_dir, value_col)
+    os.makedirs(out_dir, exist_ok=True)
+
+    years = df['year'].dt.year if pd.api.types.is_period_dtype(df['year']) else df['year']
+    longitude, latitude = df['longitude'].to_numpy(float), df['latitude'].to_numpy(float)
+    values = df[value_col].to_numpy(float)
+    bounds = get_region_bounds(longitude, latitude)
+    size = tile_size * 2 ** max_level
+
+    index = {'value_col': value_col, 'bounds': bounds, 'tile_size': tile_size, 'max_level': max_level, 'years': {}}
+    for year in sorted(years.dropna().unique()):
+        in_year = (years == year).to_numpy()
+        sums, counts = rasterise(longitude[in_year], latitude[in_year], values[in_year], bounds, size)
+
+        tiles, slots = [], {}
+        for level, grid in enumerate(build_pyramid(sums, counts, max_level)):
+            n_tiles = 2 ** level
+            grid = grid.reshape(n_tiles, tile_size, n_tiles, tile_size).swapaxes(1, 2)  # [tile y, tile x, row, col]
+            for tile_y, tile_x in zip(*np.nonzero(~np.isnan(grid).all(axis=(2, 3)))):
+                slots[f'{level}/{tile_x}/{tile_y}'] = len(tiles)
+                tiles.append(grid[tile_y, tile_x])
+
+        path = os.path.join(out_dir, f'{int(year)}.npy')
+        tile_file = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float32,
+                                              shape=(len(tiles), tile_size, tile_size))
+        if tiles:
+            tile_file[:] = np.stack(tiles)
+        tile_file.flush()
+        del tile_file
+        os.replace(path + '.tmp', path)
+
+        index['years'][str(int(year))] = {'path': path, 'tiles': slots}
+
+    index_path = os.path.join(out_dir, 'index.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + '.tmp', index_path)  # swap the index in last, so readers never see it half written
+
+    return index
+
+
+@lru_cache(maxsize=8)
+def _read_index(
+    index_path: str,
+    modified: float,
+) -> Dict[str, Any]:
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def get_tile_index(
+    value_col: str = 'interpolated_price',
+    tiles_dir: str = TILES_DIR,
+) -> Optional[Dict[str, Any]]:
+    """Get the index of the saved tiles, re-reading it only when it's been rebuilt.
+
+    Parameters
+    ----------
+    value_col : Column the surface was made from.
+    tiles_dir : Folder the tiles were saved to.
+
+    Returns
+    -------
+    Optional[Dict[str, Any]]
+        The index, or None if the tiles haven't been built yet.
+    """
+    index_path = os.path.join(tiles_dir, value_col, 'index.json')
+    if not os.path.exists(index_path):
+        return None
+
+    return _read_index(index_path, os.path.getmtime(index_path))
+
+
+@lru_cache(maxsize=64)
+def open_tile_file(
+    path: str,
+    modified: float,
+) -> np.ndarray:
+    """Memory map a years tile file, keyed on its modified time too so a rebuild gets picked up.
+
+    Parameters
+    ----------
+    path : Path of the tile file.
+    modified : Modified time of the file.
+
+    Returns
+    -------
+    np.ndarray
+        Read only memory mapped array of [slot, row, col].
+    """
+    return np.load(path, mmap_mode='r')
+
+
+def choose_level(
+    index: Dict[str, Any],
+    lon_range: List[float],
+    viewport_pixels: int = VIEWPORT_PIXELS,
+) -> int:
+    """Pick the coarsest level which still gives roughly viewport_pixels across the visible bit of the map.
+
+    Parameters
+    ----------
+    index : Tile index.
+    lon_range : Visible longitude range.
+    viewport_pixels : Pixels we want across the viewport.
+
+    Returns
+    -------
+    int
+        Level of the pyramid to read from.
+    """
+    bounds = index['bounds']
+    visible_fraction = max(lon_range[1] - lon_range[0], 1e-9) / (bounds[2] - bounds[0])
+    pixels_needed = viewport_pixels / min(visible_fraction, 1.0)
+    level = int(np.ceil(np.log2(max(pixels_needed / index['tile_size'], 1.0))))
+
+    return min(level, index['max_level'])
+
+
+def get_viewport_surface(
+    year: int,
+    lon_range: Optional[List[float]] = None,
+    lat_range: Optional[List[float]] = None,
+    value_col: str = 'interpolated_price',
+    tiles_dir: str = TILES_DIR,
+) -> Optional[Dict[str, Any]]:
+    """Stitch together the tiles covering the viewport at a level of detail to suit how far in it's zoomed.
+
+    Parameters
+    ----------
+    year : Year of the surface.
+    lon_range : Visible longitude range, or None for the whole region.
+    lat_range : Visible latitude range, or None for the whole region.
+    value_col : Column the surface was made from.
+    tiles_dir : Folder the tiles were saved to.
+
+    Returns
+    -------
+    Optional[Dict[str, Any]]
+        'z' (the stitched grid, rows south to north), 'x0' / 'y0' (long / lat of the first pixel centre), 'dx' / 'dy'
+        (pixel width / height) and 'level', or None if there are no tiles for the year.
+    """
+    index = get_tile_index(value_col, tiles_dir)
+    if index is None or str(year) not in index['years']:
+        return None
+
+    bounds, tile_size = index['bounds'], index['tile_size']
+    lon_range = lon_range or [bounds[0], bounds[2]]
+    lat_range = lat_range or [bounds[1], bounds[3]]
+    level = choose_level(index, lon_range)
+    n_tiles = 2 ** level
+
+    def tile_span(visible: List[float], low: float, high: float) -> range:
+        first = int((min(visible) - low) / (high - low) * n_tiles)
+        last = int((max(visible) - low) / (high - low) * n_tiles)
+        return range(max(first, 0), min(last, n_tiles - 1) + 1)
+
+    tiles_x = tile_span(lon_range, bounds[0], bounds[2])
+    tiles_y = tile_span(lat_range, bounds[1], bounds[3])
+    if not tiles_x or not tiles_y:
+        return None
+
+    year_info = index['years'][str(year)]
+    tile_file = open_tile_file(year_info['path'], os.path.getmtime(year_info['path']))
+    z = np.full((len(tiles_y) * tile_size, len(tiles_x) * tile_size), np.nan, dtype=np.float32)
+    for i, tile_y in enumerate(tiles_y):
+        for j, tile_x in enumerate(tiles_x):
+            slot = year_info['tiles'].get(f'{level}/{tile_x}/{tile_y}')
+            if slot is not None:  # missing tiles are the empty ones, so leave them as NaN
+                z[i * tile_size:(i + 1) * tile_size, j * tile_size:(j + 1) * tile_size] = tile_file[slot]
+
+    dx = (bounds[2] - bounds[0]) / (n_tiles * tile_size)
+    dy = (bounds[3] - bounds[1]) / (n_tiles * tile_size)
+
+    return {'z': z,
+            'x0': bounds[0] + (tiles_x[0] * tile_size + 0.5) * dx,
+            'y0': bounds[1] + (tiles_y[0] * tile_size + 0.5) * dy,
+            'dx': dx,
+            'dy': dy,
+            'level': level}
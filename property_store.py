@@ -0,0 +1,194 @@
+"""
+Read only access to the engineered property data for the dashboards, via an Arrow IPC snapshot of
+monmouthshire_properties.csv which gets memory mapped rather than read in.
+
+Two reasons for the faff:
+    - the dashboards used to pd.read_csv the whole file on import, so they took an age to start up. Now nothing is
+    opened until the first callback actually asks for data.
+    - every server worker process held its own private copy of the data. A memory mapped file lives in the OS page
+    cache instead, so all the workers share the one copy and adding more of them doesn't multiply the memory.
+
+To keep it that way the filtering is done on the arrow table itself and only the filtered rows / requested columns
+are ever turned into a pandas dataframe.
+"""
+import os
+import gzip
+import threading
+from functools import reduce, lru_cache
+from typing import List, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from data_manipulation import write_arrow_file, GRID_BOUNDS_FILE
+
+PROPERTIES_CSV = 'data/monmouthshire_properties.csv'
+PROPERTIES_SNAPSHOT = 'data/monmouthshire_properties.arrow'
+
+_TABLE = None
+_TABLE_LOCK = threading.Lock()
+
+
+def write_properties_snapshot(
+    csv_path: str = PROPERTIES_CSV,
+    snapshot_path: str = PROPERTIES_SNAPSHOT,
+) -> None:
+    """Convert the properties csv into an uncompressed Arrow IPC file, which can be memory mapped.
+
+    Notes
+    -----
+    The snapshot is built from the csv rather than straight from the engineered dataframe so the dashboards see exactly
+    the dtypes they always have done (i.e. year comes back as an int rather than a period).
+
+    Parameters
+    ----------
+    csv_path : Path of the engineered properties csv.
+    snapshot_path : Path to write the snapshot to.
+    """
+    write_arrow_file(pa.Table.from_pandas(pd.read_csv(csv_path), preserve_index=False), snapshot_path)
+
+
+def snapshot_is_stale(
+    csv_path: str = PROPERTIES_CSV,
+    snapshot_path: str = PROPERTIES_SNAPSHOT,
+) -> bool:
+    """Check whether the snapshot needs (re)building, i.e. it doesn't exist or the csv has been rewritten since.
+
+    Parameters
+    ----------
+    csv_path : Path of the engineered properties csv.
+    snapshot_path : Path of the snapshot.
+
+    Returns
+    -------
+    bool
+        True if the snapshot is missing or older than the csv.
+    """
+    if not os.path.exists(snapshot_path):
+        return True
+
+    return os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(snapshot_path)
+
+
+def get_properties_table() -> pa.Table:
+    """Get the memory mapped properties table, opening it (and building the snapshot if need be) on first use.
+
+    Returns
+    -------
+    pa.Table
+        Arrow table whose buffers point straight into the memory mapped snapshot.
+    """
+    global _TABLE
+
+    with _TABLE_LOCK:  # dash callbacks can land on multiple threads at once
+        if _TABLE is None:
+            if snapshot_is_stale():
+                write_properties_snapshot()
+            _TABLE = pa.ipc.open_file(pa.memory_map(PROPERTIES_SNAPSHOT, 'r')).read_all()
+
+    return _TABLE
+
+
+def filter_properties(
+    towns: Optional[List[str]] = None,
+    year_range: Optional[List[int]] = None,
+    columns: Optional[List[str]] = None,
+    true_price_only: bool = False,
+) -> pd.DataFrame:
+    """Filter the properties data down on the arrow side, and only then convert whats left into pandas.
+
+    Parameters
+    ----------
+    towns : Values of the 'town' column to keep, or None for all of them.
+    year_range : Start and end year to keep (inclusive), or None for all of them.
+    columns : Columns to return, or None for all of them.
+    true_price_only : Set True to keep only rows where a sale actually happened.
+
+    Returns
+    -------
+    pd.DataFrame
+        Requested rows and columns.
+    """
+    table = get_properties_table()
+
+    conditions = []
+    if towns is not None:
+        conditions.append(pc.is_in(table['town'], value_set=pa.array(towns, type=table.schema.field('town').type)))
+    if year_range is not None:
+        conditions.append(pc.greater_equal(table['year'], year_range[0]))
+        conditions.append(pc.less_equal(table['year'], year_range[1]))
+    if true_price_only:
+        conditions.append(table['true_price'])
+    mask = reduce(pc.and_, conditions) if conditions else None
+
+    if columns is not None:
+        table = table.select(list(dict.fromkeys(columns)))
+    if mask is not None:
+        table = table.filter(pc.fill_null(mask, False))
+
+    return table.to_pandas()
+
+
+def get_null_mask(columns: List[str]) -> pd.DataFrame:
+    """Get which cells of the chosen columns are NULL, without converting the columns themselves to pandas.
+
+    Notes
+    -----
+    pandas reads empty csv fields in as NaN and from_pandas turns NaN into arrow nulls, so this lines up with what
+    df.isnull() gave us back when the dashboards read the csv directly.
+
+    Parameters
+    ----------
+    columns : Columns to check.
+
+    Returns
+    -------
+    pd.DataFrame
+        Boolean dataframe, True where the value is NULL.
+    """
+    table = get_properties_table()
+
+    return pd.DataFrame({col: pc.is_null(table[col]).to_numpy() for col in columns}, columns=columns)
+
+
+@lru_cache(maxsize=None)
+def get_compact_payload(columns: Tuple[str, ...]) -> bytes:
+    """Squash the chosen columns down as small as they'll sensibly go and serialise them as a gzipped Arrow IPC stream,
+    for shipping to the browser in one go.
+
+    Notes
+    -----
+    Floats drop to float32 (still ~1m precision on long / lat), ints to int32 and strings get dictionary encoded, which
+    for columns like town is most of the saving. Gzip rather than arrows own buffer compression as the browser undoes
+    it for free via Content-Encoding, and the javascript arrow library can't read compressed buffers.
+    The bounds of the grid_cell keys go along in the schema metadata, as 'grid_bounds'.
+
+    Parameters
+    ----------
+    columns : Columns to include.
+
+    Returns
+    -------
+    bytes
+        Gzipped Arrow IPC stream.
+    """
+    table = get_properties_table().select(list(columns))
+
+    compact = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_floating(field.type):
+            column = column.cast(pa.float32())
+        elif pa.types.is_integer(field.type):
+            column = column.cast(pa.int32())
+        elif pa.types.is_string(field.type):
+            column = column.dictionary_encode()
+        compact.append(column)
+    table = pa.Table.from_arrays(compact, names=table.column_names)
+    if os.path.exists(GRID_BOUNDS_FILE):  # the grid_cell keys are meaningless without the bounds they were made over
+        with open(GRID_BOUNDS_FILE) as f:
+            table = table.replace_schema_metadata({'grid_bounds': f.read()})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return gzip.compress(sink.getvalue().to_pybytes(), compresslevel=6)
@@ -0,0 +1,253 @@
+"""
+Fake versions of the three input files, for benchmarking the pipeline at sizes well beyond our little Monmouthshire
+extract (and because the real price file isn't in the repo anyway). The values are nonsense but the columns, dtypes and
+rough shape (repeat sales, addresses per postcode, stores per county etc...) are the same as the real things.
+
+Writes out into a 'data' folder under whichever root you give it, mirroring the layout of this repo so the pipeline and
+dashboards can be run there without any changes to their file paths.
+"""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+AREAS = ['NP', 'CF', 'GL', 'HR', 'SA', 'LD', 'BS']
+TOWNS = ['COLEFORD', 'NEWPORT', 'USK', 'CHEPSTOW', 'MONMOUTH', 'CALDICOT', 'ABERGAVENNY', 'CRICKHOWELL']
+STREET_WORDS = ['HIGH', 'CHURCH', 'MILL', 'STATION', 'CASTLE', 'PARK', 'BRIDGE', 'MONK', 'CROSS', 'MARKET', 'OAK',
+                'ASH', 'ELM', 'WILLOW', 'BEACON', 'ORCHARD', 'MEADOW', 'RIVER', 'VICTORIA', 'ALBERT']
+STREET_TYPES = ['STREET', 'ROAD', 'LANE', 'CLOSE', 'AVENUE', 'DRIVE', 'COURT', 'GARDENS', 'TERRACE', 'WAY']
+HOUSE_NAMES = ['THE OLD BARN', 'HILL FARM', 'LAND AT', 'ROSE BUNGALOW', 'ANGEL HOTEL', 'KINGS ARMS', 'IVY COTTAGE',
+               'THE LODGE', 'TY NEWYDD', 'BRYN HYFRYD']
+FASCIAS = ['The Co-operative Food', 'Spar', 'Tesco Express', 'Aldi', 'Lidl', 'Iceland', 'Sainsburys Local',
+           'Sainsburys', 'Tesco', 'Morrisons']
+COUNTIES = ['Gwent', 'Powys', 'Greater London', 'Greater Manchester', 'West Midlands', 'West Yorkshire', 'Hampshire',
+            'Essex', 'Lancashire', 'Kent']
+REGION_BOUNDS = {'latitude': (51.55, 51.97), 'longitude': (-3.15, -2.65)}  # roughly Monmouthshire and around
+
+
+def random_dates(
+    rng: np.random.Generator,
+    n: int,
+    start: str,
+    end: str,
+) -> pd.Series:
+    """Pick n dates uniformly between start and end.
+
+    Parameters
+    ----------
+    rng : Numpy random generator.
+    n : Number of dates.
+    start : Earliest date, as 'YYYY-MM-DD'.
+    end : Latest date, as 'YYYY-MM-DD'.
+
+    Returns
+    -------
+    pd.Series
+        Dates formatted as 'YYYY-MM-DD' strings, like the real files have them.
+    """
+    start, end = np.datetime64(start), np.datetime64(end)
+    days = rng.integers(0, (end - start).astype(int), n)
+
+    return pd.Series((start + days).astype('datetime64[D]').astype(str))
+
+
+def generate_postcodes(
+    n_postcodes: int,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generate a doogal style postcode file, with postcodes clustered by district and sector so the postcode level
+    means in engineer_data come out sensible.
+
+    Parameters
+    ----------
+    n_postcodes : Number of distinct postcodes.
+    seed : Random seed.
+
+    Returns
+    -------
+    pd.DataFrame
+        Postcode data, columns as in monmouthshire_postcodes.csv.
+    """
+    rng = np.random.default_rng(seed)
+
+    districts = np.array([f'{area}{number}' for area in AREAS for number in range(1, 41)])
+    n_per_district = 10 * 26 * 26  # sector digit then two letters
+    n_postcodes = min(n_postcodes, len(districts) * n_per_district)
+    picks = rng.choice(len(districts) * n_per_district, n_postcodes, replace=False)
+    district_idx, within = np.divmod(picks, n_per_district)
+    sector, inward = np.divmod(within, 26 * 26)
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    first, second = letters[inward // 26], letters[inward % 26]
+
+    postcodes = (pd.Series(districts[district_idx]) + ' ' + pd.Series(sector).astype(str)
+                 + pd.Series(first) + pd.Series(second))
+
+    lat_low, lat_high = REGION_BOUNDS['latitude']
+    long_low, long_high = REGION_BOUNDS['longitude']
+    district_lat = rng.uniform(lat_low, lat_high, len(districts))
+    district_long = rng.uniform(long_low, long_high, len(districts))
+    latitude = district_lat[district_idx] + sector * 0.002 + rng.normal(0, 0.01, n_postcodes)
+    longitude = district_long[district_idx] + sector * 0.002 + rng.normal(0, 0.01, n_postcodes)
+
+    terminated = random_dates(rng, n_postcodes, '2000-01-01', '2021-01-01')
+    in_use = rng.random(n_postcodes) < 0.9
+    terminated[in_use] = np.nan
+
+    return pd.DataFrame({
+        'Postcode': postcodes,
+        'In Use?': np.where(in_use, 'Yes', 'No'),
+        'Latitude': latitude.round(6),
+        'Longitude': longitude.round(6),
+        'Easting': rng.integers(300000, 360000, n_postcodes),
+        'Northing': rng.integers(180000, 240000, n_postcodes),
+        'Grid Ref': pd.Series(rng.integers(100000, 999999, n_postcodes)).astype(str).radd('SO'),
+        'Ward': rng.choice(TOWNS, n_postcodes),
+        'Parish': rng.choice(TOWNS, n_postcodes),
+        'Introduced': random_dates(rng, n_postcodes, '1980-01-01', '2020-01-01'),
+        'Terminated': terminated,
+        'Altitude': rng.integers(0, 420, n_postcodes),
+        'Country': 'Wales',
+        'Last Updated': '2021-05-21',
+        'Quality': 'Within the building of the matched address closest to the postcode mean',
+        'LSOA Code': pd.Series(rng.integers(1001000, 1002000, n_postcodes)).astype(str).radd('W0'),
+        'LSOA Name': pd.Series(rng.integers(1, 20, n_postcodes)).astype(str).radd('Monmouthshire 0'),
+    })
+
+
+def generate_prices(
+    n_rows: int,
+    postcodes: pd.Series,
+    sales_per_property: float = 3.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generate a land registry price paid style file, where each property is sold a few times over the years.
+
+    Parameters
+    ----------
+    n_rows : Number of sales.
+    postcodes : Postcodes the properties can be located in.
+    sales_per_property : Average number of times each property sells.
+    seed : Random seed.
+
+    Returns
+    -------
+    pd.DataFrame
+        Price data, columns as in monmouthshire_prices.csv.
+    """
+    rng = np.random.default_rng(seed)
+    n_properties = max(1, int(n_rows / sales_per_property))
+
+    streets = (pd.Series(rng.choice(STREET_WORDS, n_properties)) + ' '
+               + pd.Series(rng.choice(STREET_TYPES, n_properties)))
+    numbers = pd.Series(rng.integers(1, 200, n_properties)).astype(str)
+    named = rng.random(n_properties) < 0.1
+    paon = numbers.where(~named, pd.Series(rng.choice(HOUSE_NAMES, n_properties)))
+    flat = rng.random(n_properties) < 0.1
+    saon = pd.Series(rng.integers(1, 20, n_properties)).astype(str).radd('FLAT ').where(flat)
+    property_postcode = rng.choice(np.asarray(postcodes), n_properties)
+    property_town = rng.choice(TOWNS, n_properties)
+    base_price = rng.lognormal(11.8, 0.5, n_properties)
+
+    sold = rng.integers(0, n_properties, n_rows)
+    deed_date = random_dates(rng, n_rows, '1995-01-01', '2021-06-30')
+    years_since_1995 = pd.to_datetime(deed_date).dt.year.values - 1995
+    price = (base_price[sold] * 1.05 ** years_since_1995 * rng.lognormal(0, 0.1, n_rows)).round(-2).astype(int)
+
+    return pd.DataFrame({
+        'unique_id': [f'{{{i:08X}-0000-0000-0000-000000000000}}' for i in range(n_rows)],
+        'price_paid': price,
+        'deed_date': deed_date,
+        'postcode': property_postcode[sold],
+        'property_type': rng.choice(['D', 'S', 'T', 'F', 'O'], n_rows),
+        'new_build': rng.choice(['Y', 'N'], n_rows, p=[0.1, 0.9]),
+        'estate_type': rng.choice(['F', 'L'], n_rows, p=[0.8, 0.2]),
+        'saon': saon.values[sold],
+        'paon': paon.values[sold],
+        'street': streets.values[sold],
+        'locality': np.nan,
+        'town': property_town[sold],
+        'district': 'MONMOUTHSHIRE',
+        'county': 'MONMOUTHSHIRE',
+        'transaction_category': rng.choice(['A', 'B'], n_rows, p=[0.95, 0.05]),
+        'linked_data_uri': 'http://landregistry.data.gov.uk/data/ppi/transaction/synthetic',
+    })
+
+
+def generate_supermarkets(
+    n_stores: int,
+    postcodes: pd.Series,
+    local_share: float = 0.012,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generate a geolytix style supermarket file. Only local_share of the stores land in Gwent / Powys, the rest are
+    spread about the rest of the country, same as the real national file.
+
+    Parameters
+    ----------
+    n_stores : Number of stores.
+    postcodes : Postcodes the local stores can be located in.
+    local_share : Proportion of the stores that are in the counties engineer_data actually uses.
+    seed : Random seed.
+
+    Returns
+    -------
+    pd.DataFrame
+        Supermarket data, columns as in geolityx_supermarkets_locations.csv.
+    """
+    rng = np.random.default_rng(seed)
+    local = rng.random(n_stores) < local_share
+
+    lat_low, lat_high = REGION_BOUNDS['latitude']
+    long_low, long_high = REGION_BOUNDS['longitude']
+    fascia = rng.choice(FASCIAS, n_stores)
+
+    return pd.DataFrame({
+        'id': np.arange(1010000000, 1010000000 + n_stores),
+        'retailer': fascia,
+        'fascia': fascia,
+        'store_name': pd.Series(fascia) + ' ' + pd.Series(np.arange(n_stores)).astype(str),
+        'add_one': 'Unit 1',
+        'add_two': np.nan,
+        'town': rng.choice(TOWNS, n_stores),
+        'suburb': np.nan,
+        'postcode': np.where(local, rng.choice(np.asarray(postcodes), n_stores), 'SW1A 1AA'),
+        'long_wgs': np.where(local, rng.uniform(long_low, long_high, n_stores), rng.uniform(-5.5, 1.5, n_stores)),
+        'lat_wgs': np.where(local, rng.uniform(lat_low, lat_high, n_stores), rng.uniform(50, 55.5, n_stores)),
+        'bng_e': rng.uniform(100000, 600000, n_stores),
+        'bng_n': rng.uniform(0, 600000, n_stores),
+        'pqi': 'Rooftop geocoded by Geolytix',
+        'open_date': np.nan,
+        'size_band': '< 3,013 ft2 (280m2)',
+        'county': np.where(local, rng.choice(['Gwent', 'Powys'], n_stores), rng.choice(COUNTIES[2:], n_stores)),
+    })
+
+
+def write_synthetic_data(
+    root: str,
+    n_rows: int,
+    n_stores: int = 17024,
+    seed: int = 0,
+) -> None:
+    """Write a full set of synthetic input files under root, laid out like this repos data folder, along with copies
+    of the metadata files the pipeline and dashboards read.
+
+    Parameters
+    ----------
+    root : Folder to write the 'data' directory into.
+    n_rows : Number of rows in the price file. The postcode file gets a tenth as many rows, about the same ratio as
+        the national data.
+    n_stores : Number of rows in the supermarket file.
+    seed : Random seed.
+    """
+    os.makedirs(os.path.join(root, 'data', 'metadata'), exist_ok=True)
+
+    postcodes = generate_postcodes(max(100, n_rows // 10), seed=seed)
+    postcodes.to_csv(os.path.join(root, 'data', 'monmouthshire_postcodes.csv'), index=False)
+    generate_prices(n_rows, postcodes['Postcode'], seed=seed).to_csv(
+        os.path.join(root, 'data', 'monmouthshire_prices.csv'), index=False)
+    generate_supermarkets(n_stores, postcodes['Postcode'], seed=seed).to_csv(
+        os.path.join(root, 'data', 'geolityx_supermarkets_locations.csv'), index=False)
+
+    metadata_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metadata')
+    for file_name in os.listdir(metadata_dir):
+        shutil.copy(os.path.join(metadata_dir, file_name), os.path.join(root, 'data', 'metadata', file_name))
@@ -9,16 +9,22 @@ TODO:
     - consider further analysis that might be chill
     - build as a multi page app with different themes and shit <- this is the big next step I think
 """
+import os
 import pandas as pd
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Any, Optional, Callable
 import dash
 import dash_table
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State
 import plotly.express as px
+import plotly.graph_objects as go
+from pipeline_metrics import METRICS_FILE
+from property_store import get_null_mask
+from background_jobs import handle_job_callback
+
+STACKABLE_METRICS = ['wall_seconds', 'cpu_seconds']  # durations add up across stages, RSS and row counts don't
 
-DF = pd.read_csv('data/monmouthshire_properties.csv')
 VARIABLES = pd.read_csv('data/metadata/variable_info.csv')
 SHAPE = pd.read_csv('data/metadata/property_data_shape.csv')
 
@@ -94,7 +100,34 @@ app.layout = html.Div([
                   figure={},
                   style={'display': 'inline-block',
                          'width': '40%',
-                         'height': '200%'})
+                         'height': '200%'}),
+
+        html.Div(id='null_heatmap_status'),
+        dcc.Store(id='null_heatmap_job'),
+        dcc.Interval(id='null_heatmap_poll', interval=500, disabled=True)
+    ]),
+
+    html.H1("0.4 - Pipeline Performance", style={'text-align': 'center'}),
+
+    html.Div([
+        html.Div([
+            dcc.Dropdown(id='pipeline_metric',
+                         options=[{'label': 'Wall Time (s)', 'value': 'wall_seconds'},
+                                  {'label': 'CPU Time (s)', 'value': 'cpu_seconds'},
+                                  {'label': 'Peak RSS (MB)', 'value': 'peak_rss_mb'},
+                                  {'label': 'Rows In', 'value': 'rows_in'},
+                                  {'label': 'Rows Out', 'value': 'rows_out'}],
+                         value='wall_seconds',
+                         multi=False)
+        ], style={'width': '20%', 'justifyContent': 'center', 'align-items': 'center'}),
+
+        dcc.Graph(id='pipeline_metrics_by_run',
+                  figure={},
+                  style={'display': 'inline-block', 'width': '60%'}),
+
+        dcc.Graph(id='pipeline_metrics_latest',
+                  figure={},
+                  style={'display': 'inline-block', 'width': '40%'})
     ]),
 ])
 
@@ -182,8 +215,7 @@ def update_null_bar_chart(chosen_file: str) -> px.bar:
         variables = VARIABLES['Variable Name'].tolist()
 
     df_to_plot = pd.DataFrame(
-        DF[variables]
-        .isnull()
+        get_null_mask(variables)
         .sum(axis=1)
         .round(2)
         .value_counts()
@@ -198,35 +230,145 @@ def update_null_bar_chart(chosen_file: str) -> px.bar:
     return fig
 
 
-@app.callback(
-    Output(component_id='null_heatmap', component_property='figure'),
-    Input(component_id='choose_file', component_property='value')
-)
-def update_null_heatmap(chosen_file: str) -> px.imshow:
-    """Update NULL value heatmap to display only the columns from the chosen file.
+def build_null_heatmap(
+    chosen_file: str,
+    progress: Callable[[float, str], None],
+) -> Dict[str, Any]:
+    """Build the NULL value heatmap for only the columns from the chosen file. Runs as a background job as its a
+    pretty massive image for the complete file.
 
     Parameters
     ----------
     chosen_file : Name of file to display info for.
+    progress : Reporter to tell the dashboard how we're getting on.
 
     Returns
     -------
-    px.density_heatmap
-        Heatmap of NULL locations in given file.
+    Dict[str, Any]
+        Heatmap of NULL locations in given file, as a dict.
     """
     if chosen_file != 'Complete':
         variables = VARIABLES[VARIABLES['Source File'] == chosen_file]['Variable Name'].tolist()
     else:
         variables = VARIABLES['Variable Name'].tolist()
 
-    df_to_plot = DF[variables].isnull()
+    progress(0.1, 'Finding NULLs')
+    df_to_plot = get_null_mask(variables)
     df_to_plot = df_to_plot.loc[(df_to_plot != 0).any(1), (df_to_plot != 0).any(0)]
 
+    progress(0.4, 'Drawing heatmap')
     fig = px.imshow(df_to_plot,
                     labels=dict(x="Column Names", y="Row IDs"),
                     title='0.3.2 Column NULL Map')
 
-    return fig
+    return fig.to_dict()
+
+
+@app.callback(
+    [Output(component_id='null_heatmap', component_property='figure'),
+     Output(component_id='null_heatmap_status', component_property='children'),
+     Output(component_id='null_heatmap_job', component_property='data'),
+     Output(component_id='null_heatmap_poll', component_property='disabled')],
+    [Input(component_id='null_heatmap_poll', component_property='n_intervals'),
+     Input(component_id='choose_file', component_property='value')],
+    State(component_id='null_heatmap_job', component_property='data')
+)
+def update_null_heatmap(
+    n_intervals: int,
+    chosen_file: str,
+    job_id: Optional[str],
+) -> Tuple[Any, str, Optional[str], bool]:
+    """Kick off building the NULL heatmap in the background when a new file is chosen, replacing any build still
+    going for the last one, then check in on it each time the poll fires until its ready.
+
+    Parameters
+    ----------
+    n_intervals : Number of times the poll has fired, only here to trigger the callback.
+    chosen_file : Name of file to display info for.
+    job_id : ID of the current background job, if any.
+
+    Returns
+    -------
+    Tuple[Any, str, Optional[str], bool]
+        The figure once it's ready, progress message, job ID and whether to stop polling.
+    """
+    poll_triggered = dash.callback_context.triggered[0]['prop_id'].startswith('null_heatmap_poll')
+
+    return handle_job_callback(poll_triggered, job_id, build_null_heatmap, chosen_file)
+
+
+def get_pipeline_metrics() -> pd.DataFrame:
+    """Read in the per stage metrics recorded by instrumented runs of engineer_data, fresh on each call so that new runs
+    show up without restarting the dashboard.
+
+    Returns
+    -------
+    pd.DataFrame
+        Row per stage per run, empty if the pipeline has never been run with instrument=True.
+    """
+    if not os.path.exists(METRICS_FILE):
+        return pd.DataFrame(columns=['run_id', 'stage', 'parent_stage', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb',
+                                     'rows_in', 'rows_out', 'start_seconds', 'on_critical_path'])
+
+    metrics = pd.read_csv(METRICS_FILE)
+    for col in ['parent_stage', 'on_critical_path']:  # recorded before steps were tracked / the pipeline ran as a DAG
+        if col not in metrics.columns:
+            metrics[col] = None
+
+    return metrics
+
+
+@app.callback(
+    [Output(component_id='pipeline_metrics_by_run', component_property='figure'),
+     Output(component_id='pipeline_metrics_latest', component_property='figure')],
+    Input(component_id='pipeline_metric', component_property='value')
+)
+def update_pipeline_metrics(metric: str) -> Tuple[px.bar, px.bar]:
+    """Chart the chosen metric for each pipeline stage across all recorded runs, plus a breakdown of the latest run.
+
+    Parameters
+    ----------
+    metric : Name of the metric column to plot.
+
+    Returns
+    -------
+    Tuple[px.bar, px.bar]
+        Bars of the metric per run coloured by stage, and bars of the metric per stage (and step within a stage) for
+        the latest run coloured by whether the stage was on the critical path, with the steps coloured separately.
+        Durations get stacked, counting only the top level stages so the steps within them aren't counted twice.
+        Stages run concurrently, so the stacked wall times can add up to more than the run actually took. Peak RSS and
+        row counts mean nothing summed, so they're grouped side by side instead.
+        If nothing's been recorded yet both are just empty figures saying so.
+    """
+    metrics = get_pipeline_metrics()
+    if metrics.empty:  # px.bar can't cope with an empty frame, so just say how to get some metrics
+        title = 'No instrumented runs yet, run `python engineer_data.py --instrument`'
+        return go.Figure(layout={'title': title}), go.Figure(layout={'title': title})
+
+    latest = metrics[metrics['run_id'] == metrics['run_id'].max()].copy()
+    is_step = latest['parent_stage'].notnull()
+    latest['on_critical_path'] = latest['on_critical_path'].map({True: 'Critical path', False: 'Off critical path'})
+    latest.loc[is_step, 'on_critical_path'] = 'Step within a stage'  # only the top level stages get scheduled
+    latest['on_critical_path'] = latest['on_critical_path'].fillna('Not recorded')  # runs from before the DAG
+    latest.loc[is_step, 'stage'] = latest.loc[is_step, 'parent_stage'] + ' / ' + latest.loc[is_step, 'stage']
+
+    stackable = metric in STACKABLE_METRICS
+    by_run = px.bar(metrics[metrics['parent_stage'].isnull()] if stackable else metrics,
+                    x='run_id',
+                    y=metric,
+                    color='stage',
+                    barmode='stack' if stackable else 'group',
+                    labels={'run_id': 'Run'},
+                    title='0.4.1 Pipeline Stages Across Runs')
+    latest_fig = px.bar(latest.sort_values(by=metric),
+                        x=metric,
+                        y='stage',
+                        orientation='h',
+                        color='on_critical_path',
+                        labels={'on_critical_path': ''},
+                        title='0.4.2 Stages of the Latest Run')
+
+    return by_run, latest_fig
 
 
 if __name__ == '__main__':